@@ -0,0 +1,506 @@
+# ------------------------------------------------------------------------------------------
+# Benchmark für create_epub_from_html.py
+# Erzeugt eine synthetische index.html und misst das Kapitel-Splitting.
+#
+# Hans Straßgütl
+# Aufruf:
+#       python benchmark_create_epub.py [--chapters 200] [--nodes 200] [--repeat 3]
+#       python benchmark_create_epub.py --parsers           Parser-Backends und Streaming vergleichen
+#       python benchmark_create_epub.py --writer [--writer-mb 1024]
+#                                                           Speicher-Peak ebooklib vs. Streaming-Writer
+#       python benchmark_create_epub.py --build [--chapters 50 --nodes 100 --images 20 ...]
+#                                       [--baseline benchmark_baseline.json] [--save-baseline] [--threshold 0.25]
+#                                                           Kompletter Build eines synthetischen Projekts, Zeit je
+#                                                           Phase, Vergleich mit der Baseline (Exit-Code 1 bei Regression)
+#       python benchmark_create_epub.py --reproducible      Reproduzierbarer Build: je Writer mit und ohne Cache
+#                                                           byte-gleiche EPUBs (Exit-Code 1 bei Abweichung)
+#
+# Stand:
+#       2026-01-02      Vergleich alter Kapitel-Loop (str() + Re-Parse) gegen assemble_chapter()
+#                       Vergleich der Parser-Backends inkl. Streaming (Zeit und Speicher-Peak)
+#                       Speicher-Vergleich der EPUB-Writer mit synthetischen Bildern
+#                       Synthetisches Projekt (Bilder, Duplikate, Fonts, iframes, <hide>), kompletter Build
+#                       mit Profil je Phase und Vergleich gegen eine gespeicherte Baseline
+#                       Prüfung reproduzierbarer Builds (beide Writer, Cache an/aus, Font-Subsetting)
+#
+# ------------------------------------------------------------------------------------------
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+from bs4 import BeautifulSoup, Tag, Comment
+from ebooklib import epub
+
+import create_epub_from_html as cefh
+
+
+def generate_html(chapters=200, nodes=200, seed=1):
+    """Erzeugt eine index.html mit <break> Kapiteln, Absätzen, Listen und Bildern."""
+    rnd = random.Random(seed)
+    words = ("Piste Atlas Oase Tajine Souk Pass Kasbah Wüste Düne Tankstelle "
+             "Camping Fähre Grenze Medina Route Schotter Regen Sonne").split()
+    parts = ['<html><head><title>Benchmark</title></head><body>']
+    for c in range(chapters):
+        parts.append('<break></break>')
+        parts.append(f'<h1 id="tag{c:03d}">Tag {c + 1}: {rnd.choice(words)}</h1>')
+        for n in range(nodes):
+            kind = n % 10
+            text = " ".join(rnd.choice(words) for _ in range(20))
+            if kind == 0:
+                parts.append(f'<h2>{text[:40]}</h2>')
+            elif kind == 1:
+                parts.append(f'<p><img src="bilder/img{rnd.randrange(50):03d}.jpg" width="400"/></p>')
+            elif kind == 2:
+                parts.append('<ul>' + "".join(f'<li>{w}</li>' for w in text.split()[:5]) + '</ul>')
+            elif kind == 3:
+                parts.append('<a href="#index"><button>Zurück zum Index</button></a>')
+            elif kind == 4:
+                parts.append('<!-- Kommentar -->')
+            else:
+                parts.append(f'<p class="text">{text} &amp; <b>{rnd.choice(words)}</b></p>')
+            parts.append('\n')
+    parts.append('</body></html>')
+    return "".join(parts)
+
+
+def split_sections(body_contents):
+    """Kapitel-Splitting wie im bisherigen create_epub()."""
+    sections = []
+    current_section = []
+    for element in body_contents:
+        if isinstance(element, Comment): continue
+        if isinstance(element, Tag) and element.name in ['hr']: continue
+        if isinstance(element, Tag) and element.name in ['break']:
+            if current_section: sections.append(current_section)
+            current_section = [element]
+        else:
+            current_section.append(element)
+    if current_section: sections.append(current_section)
+    return sections
+
+
+def legacy_build(html):
+    """Der bisherige Loop: jeder Knoten wird serialisiert, neu geparst und zweimal angehängt."""
+    soup = BeautifulSoup(html, 'html.parser')
+    out = []
+    for section in split_sections(soup.body.contents):
+        chap_soup = BeautifulSoup(cefh.CHAPTER_TEMPLATE, 'html.parser')
+        for item in section:
+            node = BeautifulSoup(str(item), 'html.parser').contents[0]
+            chap_soup.body.append(node)
+            chap_soup.body.append(node)
+        out.append(chap_soup.encode(formatter="html"))
+    return out
+
+
+def engine_build(html):
+    """Der neue Loop: Knoten werden einmal gelöst und direkt umgehängt."""
+    soup = BeautifulSoup(html, 'html.parser')
+    out = []
+    for section in cefh.split_sections(cefh.detach_children(soup.body)):
+        chap_soup = cefh.assemble_chapter(section)
+        out.append(chap_soup.encode(formatter="html"))
+    return out
+
+
+def best_of(func, html, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(html)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_parsers(html):
+    """Misst iter_sections() für jedes installierte Backend, mit und ohne Streaming."""
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'index.html')
+        with open(source, 'w', encoding='utf-8') as f:
+            f.write(html)
+        for parser in cefh.PARSER_PREFERENCE:
+            if not cefh.parser_available(parser):
+                print(f"{parser:14s} nicht installiert")
+                continue
+            for streaming in (False, True):
+                tracemalloc.start()
+                start = time.perf_counter()
+                count = sum(1 for section in cefh.iter_sections(source, parser, streaming) if section.nodes)
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                mode = "Streaming" if streaming else "DOM"
+                print(f"{parser:14s} {mode:10s} {elapsed:8.3f} s  Peak {peak / 1024 / 1024:8.1f} MB  {count} Sektionen")
+
+
+def generate_images(folder, total_mb, image_mb=8):
+    """Schreibt zufällige (nicht komprimierbare) .jpg Dateien mit zusammen total_mb MB."""
+    block = 1024 * 1024
+    paths = []
+    for n in range(max(1, total_mb // image_mb)):
+        path = os.path.join(folder, f"img{n:04d}.jpg")
+        with open(path, 'wb') as f:
+            for _ in range(image_mb):
+                f.write(os.urandom(block))
+        paths.append(path)
+    return paths
+
+
+def _writer_book(paths, lazy):
+    """Minimales Buch mit einem Kapitel und allen Bildern."""
+    book = epub.EpubBook()
+    book.set_title("Writer Benchmark")
+    book.set_language("de")
+    book.set_identifier("writer-benchmark")
+    chap = epub.EpubHtml(title="Kapitel 1", file_name="chap_0.xhtml", lang="de")
+    chap.content = "<html><body><h1>Bilder</h1>" + "".join(
+        f'<img src="{os.path.basename(p)}"/>' for p in paths) + "</body></html>"
+    book.add_item(chap)
+    if lazy:
+        registry = cefh.ResourceRegistry(book)
+        for path in paths:
+            registry.add_file(path, 'img', 'image/jpeg')
+    else:
+        # Bisheriger Weg: alle Bytes liegen in EpubItem.content
+        for n, path in enumerate(paths):
+            with open(path, 'rb') as f:
+                book.add_item(epub.EpubItem(uid=f"img{n}", file_name=os.path.basename(path),
+                                            media_type="image/jpeg", content=f.read()))
+    book.toc = (chap,)
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    book.spine = ['nav', chap]
+    return book
+
+
+def bench_writer(total_mb):
+    """Vergleicht Speicher-Peak und Zeit: ebooklib mit Bytes im Speicher vs. Streaming-Writer."""
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Erzeuge {total_mb} MB synthetische Bilder ...")
+        paths = generate_images(tmp, total_mb)
+        for label, lazy, writer in (("ebooklib (Bytes im Speicher)", False, "ebooklib"),
+                                    ("Streaming-Writer (FileItem)", True, "stream")):
+            output = os.path.join(tmp, f"{writer}.epub")
+            tracemalloc.start()
+            start = time.perf_counter()
+            cefh.write_book(output, _writer_book(paths, lazy), writer)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            size = os.path.getsize(output)
+            os.remove(output)
+            print(f"{label:30s} {elapsed:8.2f} s  Peak {peak / 1024 / 1024:9.1f} MB  EPUB {size / 1024 / 1024:9.1f} MB")
+
+
+# ------------------------------------------------------------------------------------------
+# Kompletter Build eines synthetischen Projekts (läuft offline, Pillow und fontTools optional)
+# ------------------------------------------------------------------------------------------
+BUILD_DEFAULTS = {'chapters': 50, 'nodes': 100, 'images': 20, 'duplicates': 5, 'fonts': 2, 'iframes': 5,
+                  'hides': 5, 'image_size': 800}
+BASELINE_MIN_SECONDS = 0.05                                                 # kürzere Phasen sind nur Rauschen
+
+
+def _write_image(path, size, rnd):
+    """JPEG mit Rauschen (kaum komprimierbar wie ein Foto). Ohne Pillow: zufällige Bytes."""
+    width, height = size, size * 3 // 4
+    if cefh.module_available('PIL'):
+        from PIL import Image
+        Image.frombytes('RGB', (width, height), rnd.randbytes(width * height * 3)).save(path, 'JPEG', quality=85)
+    else:
+        with open(path, 'wb') as f:
+            f.write(rnd.randbytes(width * height // 4))
+
+
+def _write_font(path, family):
+    """Einfacher TrueType-Font (ASCII und Umlaute) mit fontTools. Ohne fontTools: zufällige Bytes."""
+    chars = [chr(c) for c in range(32, 127)] + list("äöüÄÖÜß–")
+    if not cefh.module_available('fontTools'):
+        with open(path, 'wb') as f:
+            f.write(os.urandom(50 * 1024))
+        return
+    from fontTools.fontBuilder import FontBuilder
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+
+    def box():
+        pen = TTGlyphPen(None)
+        pen.moveTo((100, 0))
+        pen.lineTo((100, 700))
+        pen.lineTo((500, 700))
+        pen.lineTo((500, 0))
+        pen.closePath()
+        return pen.glyph()
+
+    glyph_order = ['.notdef'] + [f"uni{ord(c):04X}" for c in chars]
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(glyph_order)
+    builder.setupCharacterMap({ord(c): f"uni{ord(c):04X}" for c in chars})
+    builder.setupGlyf({name: box() for name in glyph_order})
+    builder.setupHorizontalMetrics({name: (600, 100) for name in glyph_order})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({'familyName': family, 'styleName': 'Regular'})
+    builder.setupOS2()
+    builder.setupPost()
+    builder.save(path)
+
+
+def generate_project(folder, chapters=50, nodes=100, images=20, duplicates=5, fonts=2, iframes=5, hides=5,
+                     image_size=800, seed=1):
+    """Legt ein Projekt an, wie create_epub() es erwartet, und liefert den Pfad der JSON.
+
+    index.html mit <break> Kapiteln (Bilder mehrfach referenziert, <hide> Blöcke, iframes),
+    style.css mit @font-face, bilder/ (duplicates Bilder sind Byte-Kopien unter anderem Namen,
+    je iframe ein fertiges TAGxx.jpg), fonts/, karten/ mit den iframe-Seiten und die JSON.
+    """
+    rnd = random.Random(seed)
+    for sub in ('bilder', 'fonts', 'karten'):
+        os.makedirs(os.path.join(folder, sub), exist_ok=True)
+
+    image_names = [f"img{n:03d}.jpg" for n in range(images)]
+    for n, name in enumerate(image_names):
+        path = os.path.join(folder, 'bilder', name)
+        if n >= images - duplicates and n >= duplicates:
+            shutil.copyfile(os.path.join(folder, 'bilder', image_names[n - duplicates]), path)
+        else:
+            _write_image(path, image_size, rnd)
+    for n in range(iframes):
+        _write_image(os.path.join(folder, 'bilder', f"TAG{n:02d}.jpg"), image_size // 2, rnd)
+        with open(os.path.join(folder, 'karten', f"TAG{n:02d}.html"), 'w', encoding='utf-8') as f:
+            f.write(f'<html><body><div id="map">Karte {n}</div></body></html>')
+    _write_image(os.path.join(folder, 'bilder', 'cover.jpg'), image_size, rnd)
+
+    families = [f"Bench{n}" for n in range(fonts)]
+    css = []
+    for family in families:
+        _write_font(os.path.join(folder, 'fonts', f"{family}.ttf"), family)
+        css.append(f'@font-face {{ font-family: "{family}"; src: url("fonts/{family}.ttf"); }}')
+    css.append(f'body {{ font-family: "{families[0]}", serif; }}' if families else 'body { font-family: serif; }')
+    css.append(f'h1, h2 {{ font-family: "{families[-1]}"; }}' if families else '')
+    css.append('p.text { margin: 0 0 1em 0; } .button { display: block; } .unbenutzt { color: red; }')
+    css.append('@media (min-width: 1200px) { body { margin: 0 20%; } }')
+    with open(os.path.join(folder, 'style.css'), 'w', encoding='utf-8') as f:
+        f.write("\n".join(css))
+
+    html = generate_html(chapters, nodes, seed)
+    pieces = html.split('<break></break>')
+    body = [pieces[0]]
+    for c, piece in enumerate(pieces[1:]):
+        extra = ""
+        if c < hides:
+            extra += '<hide><p>Nur im Web sichtbar</p><img src="bilder/img000.jpg"/></hide>'
+        if c < iframes:
+            extra += f'<iframe src="karten/TAG{c:02d}.html" width="600" height="400"></iframe>'
+        body.append('<break></break>' + extra + piece)
+    html = "".join(body)
+    # generate_html() zieht aus 50 Bildnamen, hier gibt es nur images viele
+    if images:
+        html = re.sub(r'bilder/img(\d{3})\.jpg', lambda m: f"bilder/{image_names[int(m.group(1)) % images]}", html)
+    with open(os.path.join(folder, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write(html)
+
+    config = json.loads(json.dumps(cefh.DEFAULT_CONFIG))
+    config['config'].update({'source_html': 'index.html', 'source_css': 'style.css', 'folder_fonts': 'fonts',
+                             'folder_bilder': 'bilder', 'cover_image': 'cover.jpg', 'output_epub': 'bench.epub',
+                             'preface': 'none', 'cache_folder': 'none', 'profile': True,
+                             'profile_json': 'build_profile.json', 'css_prune': True,
+                             'font_subset': cefh.module_available('fontTools'),
+                             'image_max_edge': image_size // 2 if cefh.module_available('PIL') else 0,
+                             'image_quality': 80 if cefh.module_available('PIL') else 0})
+    json_file = os.path.join(folder, 'bench.json')
+    with open(json_file, 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=4, ensure_ascii=False)
+    return json_file
+
+
+def measure_build(json_file, overrides=None):
+    """Ein kompletter Build ohne Ausgaben. Rückgabe: das Profil (siehe BuildProfiler.finish())."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        cefh.create_epub(json_file, overrides=overrides)
+    with open(os.path.join(os.path.dirname(json_file), 'build_profile.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def build_metrics(profiles):
+    """Bestwerte über alle Wiederholungen: Wall-Zeit je Phase und gesamt, Speicher-Peak gesamt."""
+    metrics = {'gesamt': min(p['total']['wall_s'] for p in profiles)}
+    for profile in profiles:
+        for phase in profile['phases']:
+            metrics[phase['name']] = min(metrics.get(phase['name'], phase['wall_s']), phase['wall_s'])
+    peaks = [p['total']['peak_mb'] for p in profiles if p['total']['peak_mb'] is not None]
+    return metrics, (min(peaks) if peaks else None)
+
+
+def compare_baseline(baseline, metrics, peak_mb, threshold):
+    """Druckt Baseline gegen aktuelle Messung und liefert die Namen der Regressionen."""
+    regressions = []
+    print(f"\n{'Phase':24s} {'Baseline s':>11s} {'Jetzt s':>9s} {'Änderung':>9s}")
+    rows = [(name, baseline['metrics'].get(name), value) for name, value in metrics.items()]
+    if peak_mb is not None and baseline.get('peak_mb') is not None:
+        rows.append(('Peak MB', baseline['peak_mb'], peak_mb))
+    for name, old, new in rows:
+        if old is None:
+            print(f"{name:24s} {'-':>11s} {new:9.3f}      neu")
+            continue
+        change = (new - old) / old if old else 0.0
+        regressed = change > threshold and (name == 'Peak MB' or new - old > BASELINE_MIN_SECONDS)
+        if regressed:
+            regressions.append(name)
+        print(f"{name:24s} {old:11.3f} {new:9.3f} {change * 100:+8.1f}%{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def bench_build(args):
+    """Generiert das Projekt, baut es args.repeat Mal und vergleicht mit der Baseline."""
+    params = {key: getattr(args, key) for key in BUILD_DEFAULTS}
+    overrides = {'profile_memory': args.memory, 'writer': args.writer_name}
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = args.keep or tmp
+        start = time.perf_counter()
+        json_file = generate_project(folder, **params)
+        print(f"Synthetisches Projekt in {time.perf_counter() - start:.1f} s erzeugt: "
+              + ", ".join(f"{key} {value}" for key, value in params.items()))
+        profiles = [measure_build(json_file, overrides) for _ in range(args.repeat)]
+    metrics, peak_mb = build_metrics(profiles)
+    for name, value in metrics.items():
+        print(f"{name:24s} {value:9.3f} s")
+    if peak_mb is not None:
+        print(f"{'Peak MB':24s} {peak_mb:9.1f}")
+
+    current = {'params': params, 'writer': args.writer_name, 'python': sys.version.split()[0],
+               'metrics': metrics, 'peak_mb': peak_mb}
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2, ensure_ascii=False)
+        print(f"Baseline gespeichert: {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"HINWEIS: Keine Baseline {args.baseline} gefunden (anlegen mit --save-baseline).")
+        return
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('params') != params or baseline.get('writer') != args.writer_name:
+        print(f"FEHLER: Baseline {args.baseline} wurde mit anderen Parametern gemessen: {baseline.get('params')}")
+        raise SystemExit(2)
+    regressions = compare_baseline(baseline, metrics, peak_mb, args.threshold)
+    if regressions:
+        print(f"FEHLER: {len(regressions)} Regressionen über {args.threshold * 100:.0f}%: {', '.join(regressions)}")
+        raise SystemExit(1)
+    print(f"Keine Regression über {args.threshold * 100:.0f}%.")
+
+
+def _entry_digests(epub_file):
+    """SHA-1 je ZIP-Eintrag, damit eine Abweichung die betroffenen Dateien nennt."""
+    with zipfile.ZipFile(epub_file) as z:
+        return {name: hashlib.sha1(z.read(name)).hexdigest() for name in z.namelist()}
+
+
+def check_reproducible(args):
+    """Baut das synthetische Projekt reproduzierbar: je Writer zweimal ohne und zweimal mit Cache
+    (Fehlschlag, dann Treffer). Alle EPUBs eines Writers müssen byte-gleich sein.
+
+    Font-Subsetting und Bildoptimierung sind an, soweit fontTools und Pillow installiert sind.
+    Zwischen den Builds vergeht mindestens eine Sekunde, damit Zeitstempel auffallen.
+    """
+    params = {key: getattr(args, key) for key in BUILD_DEFAULTS}
+    failed = []
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = args.keep or tmp
+        json_file = generate_project(folder, **params)
+        output = os.path.join(folder, 'bench.epub')
+        for writer in ('ebooklib', 'stream'):
+            shutil.rmtree(os.path.join(folder, '.epub_cache'), ignore_errors=True)
+            reference = None
+            for cache_folder in ('none', 'none', '.epub_cache', '.epub_cache'):
+                overrides = {'reproducible': True, 'writer': writer, 'cache_folder': cache_folder, 'profile': False}
+                with contextlib.redirect_stdout(io.StringIO()):
+                    cefh.create_epub(json_file, overrides=overrides)
+                digests = _entry_digests(output)
+                if reference is None:
+                    reference = digests
+                else:
+                    diff = sorted(name for name in set(reference) | set(digests) if reference.get(name) != digests.get(name))
+                    label = f"{writer}, Cache {cache_folder}"
+                    print(f"{label:30s} {'gleich' if not diff else 'ABWEICHUNG: ' + ', '.join(diff[:5])}")
+                    if diff:
+                        failed.append(label)
+                time.sleep(1.1)
+    if failed:
+        print(f"FEHLER: {len(failed)} Builds nicht byte-gleich.")
+        raise SystemExit(1)
+    print("Alle Builds byte-gleich.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Kapitel-Splitting")
+    parser.add_argument("--chapters", type=int, help="Standard 200, mit --build 50")
+    parser.add_argument("--nodes", type=int, help="Standard 200, mit --build 100")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--parsers", action="store_true", help="Parser-Backends vergleichen")
+    parser.add_argument("--writer", action="store_true", help="EPUB-Writer vergleichen (Speicher)")
+    parser.add_argument("--writer-mb", type=int, default=1024, help="Größe der synthetischen Bilder in MB")
+    parser.add_argument("--build", action="store_true", help="Kompletten Build eines synthetischen Projekts messen")
+    parser.add_argument("--images", type=int, default=BUILD_DEFAULTS['images'], help="Anzahl Bilder (--build)")
+    parser.add_argument("--duplicates", type=int, default=BUILD_DEFAULTS['duplicates'],
+                        help="davon Byte-Kopien unter anderem Namen")
+    parser.add_argument("--fonts", type=int, default=BUILD_DEFAULTS['fonts'], help="Anzahl Fonts (--build)")
+    parser.add_argument("--iframes", type=int, default=BUILD_DEFAULTS['iframes'], help="Anzahl iframes (--build)")
+    parser.add_argument("--hides", type=int, default=BUILD_DEFAULTS['hides'], help="Anzahl <hide> Blöcke (--build)")
+    parser.add_argument("--image-size", type=int, default=BUILD_DEFAULTS['image_size'], help="Bildbreite in Pixel")
+    parser.add_argument("--writer-name", default="ebooklib", help="Writer für --build (ebooklib/stream)")
+    parser.add_argument("--memory", action="store_true", help="Speicher-Peak je Phase messen (langsamer)")
+    parser.add_argument("--baseline", default="benchmark_baseline.json", help="Baseline-Datei (--build)")
+    parser.add_argument("--save-baseline", action="store_true", help="Messung als neue Baseline speichern")
+    parser.add_argument("--threshold", type=float, default=0.25, help="erlaubte Verschlechterung (0.25 = 25%%)")
+    parser.add_argument("--reproducible", action="store_true",
+                        help="Reproduzierbaren Build prüfen (beide Writer, mit und ohne Cache)")
+    parser.add_argument("--keep", help="Projekt in diesen Ordner schreiben statt in einen temporären")
+    args = parser.parse_args()
+    args.chapters = args.chapters or (BUILD_DEFAULTS['chapters'] if args.build or args.reproducible else 200)
+    args.nodes = args.nodes or (BUILD_DEFAULTS['nodes'] if args.build or args.reproducible else 200)
+
+    if args.writer:
+        bench_writer(args.writer_mb)
+        return
+
+    if args.build:
+        bench_build(args)
+        return
+
+    if args.reproducible:
+        check_reproducible(args)
+        return
+
+    html = generate_html(args.chapters, args.nodes)
+    print(f"Synthetische HTML: {len(html) / 1024 / 1024:.1f} MB, {args.chapters} Kapitel à {args.nodes} Knoten")
+
+    if args.parsers:
+        bench_parsers(html)
+        return
+
+    t_old, out_old = best_of(legacy_build, html, args.repeat)
+    t_new, out_new = best_of(engine_build, html, args.repeat)
+
+    identical = out_old == out_new
+    print(f"Alter Loop (str + Re-Parse): {t_old:8.3f} s")
+    print(f"assemble_chapter():          {t_new:8.3f} s")
+    print(f"Speedup:                     {t_old / t_new:8.2f} x")
+    print(f"Kapitel byte-identisch:      {'ja' if identical else 'NEIN'}")
+    if not identical:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,6 +18,23 @@
 #                       "Zurück zum Index" Links und Darstellung angepasst.
 #                       Jetzt mit JSON Steuerung
 #                       JSON hardened.
+#       2026-01-02      Parser-Backend über JSON wählbar (auto/lxml/html5-parser/html.parser).
+#                       Streaming-Modus: Sektionen werden beim Lesen an <break> zerlegt.
+#                       Ressourcen-Registry: O(1) Lookups, Namenskollisionen, Duplikate.
+#                       Bild-Optimierung (Größe, Qualität, EXIF) parallel im Prozess-Pool.
+#                       Build-Cache: unveränderte Kapitel, Bilder und CSS werden wiederverwendet.
+#                       Streaming-Writer: Dateien werden direkt von der Platte ins ZIP kopiert.
+#                       Font-Subsetting auf die im Buch genutzten Zeichen, optional als WOFF2.
+#                       CSS-Pruning: nur Regeln, die in den Kapiteln greifen, bleiben im Buch.
+#                       Batch-Modus: viele Bücher (JSON-Dateien) parallel in einem Prozess-Pool.
+#                       Profiling: Zeit, CPU, I/O und Speicher je Phase, Kapitel-Zähler als JSON.
+#                       Watch-Modus: bei jeder Änderung nur geänderte Sektionen neu bauen.
+#                       iframe-Seiten ohne Bild werden mit Chromium/wkhtmltoimage gerendert (gecacht).
+#                       source_html: auch mehrere Dateien (Liste oder Muster), jede Datei wird einzeln geparst.
+#                       Zu große Kapitel werden an Überschriften in mehrere Dateien geteilt.
+#                       Link-Index: Links auf Anker in anderen Kapiteln zeigen auf die richtige Datei.
+#                       Reproduzierbare Builds: festes Datum (SOURCE_DATE_EPOCH), stabile ID, gleiche Bytes.
+#                       Asset-Manifest: Bilder-/Font-Ordner einmal scannen, Bericht fehlender/ungenutzter Dateien.
 # 
 # ------------------------------------------------------------------------------------------
 
@@ -25,10 +42,33 @@ import os
 import sys
 import re
 import json
+import copy
+import io
+import glob
+import argparse
+import contextlib
+import traceback
+import hashlib
+import importlib
+import time
+import shutil
+import stat
+import zipfile
+import subprocess
+import tempfile
+import filecmp
+import uuid
+import cProfile
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from html.parser import HTMLParser
 from bs4 import BeautifulSoup, Tag, Comment
+import soupsieve
+import ebooklib
 from ebooklib import epub
 from datetime import datetime, timezone
 from pathlib import Path
+import multiprocessing
 
 # --- Konfiguration ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -49,7 +89,34 @@ DEFAULT_CONFIG = {
         "folder_fonts": "fonts",
         "folder_bilder": "bilder",
         "cover_image": "cover.jpg",
-        "output_epub": "Reisebegleiter.epub"
+        "output_epub": "Reisebegleiter.epub",
+        "parser": "auto",
+        "streaming": False,
+        "image_max_edge": 0,
+        "image_quality": 0,
+        "image_strip_exif": False,
+        "image_workers": 0,
+        "cache_folder": ".epub_cache",
+        "cache_max_mb": 500,
+        "writer": "ebooklib",
+        "font_subset": False,
+        "font_woff2": False,
+        "css_prune": False,
+        "css_prune_min_width": 1024,
+        "chapter_max_kb": 0,
+        "chapter_max_nodes": 0,
+        "chapter_toc": False,
+        "reproducible": False,
+        "build_date": "",
+        "asset_scan_workers": 0,
+        "iframe_render": "none",
+        "iframe_width": 1024,
+        "iframe_height": 768,
+        "iframe_delay_ms": 2000,
+        "profile": False,
+        "profile_json": "build_profile.json",
+        "profile_memory": False,
+        "profile_pstats": ""
     }
 }
 
@@ -71,7 +138,7 @@ def load_json(json_file_name=None):
     # 1. Laden oder Neuerstellen
     if not os.path.exists(json_file_name):
         print(f"HINWEIS: {json_file_name} nicht gefunden. Erstelle Default-JSON.")
-        data = DEFAULT_CONFIG
+        data = copy.deepcopy(DEFAULT_CONFIG)                            # Defaults bleiben unverändert
         needs_update = True
     else:
         try:
@@ -79,19 +146,19 @@ def load_json(json_file_name=None):
                 data = json.load(f)
         except Exception as e:
             print(f"FEHLER beim Lesen der JSON ({e}). Nutze Defaults.")
-            data = DEFAULT_CONFIG
+            data = copy.deepcopy(DEFAULT_CONFIG)
             needs_update = True
 
     # 2. Key-Check (Selbstheilung)
     for section, keys in DEFAULT_CONFIG.items():
         if section not in data:
-            data[section] = keys
+            data[section] = copy.deepcopy(keys)
             print(f"FEHLER: Sektion '{section}' fehlte. Wiederhergestellt.")
             needs_update = True
         else:
             for k, v in keys.items():
                 if k not in data[section]:
-                    data[section][k] = v
+                    data[section][k] = copy.deepcopy(v)
                     print(f"FEHLER: Parameter '{section}->{k}' fehlte. Default gesetzt.")
                     needs_update = True
 
@@ -102,84 +169,2231 @@ def load_json(json_file_name=None):
     
     return data
 
-def check_resources(config):
-    """Prüft, ob alle in der Config genannten Dateien und Ordner existieren."""
+def check_resources(config, base_dir=BASE_DIR, manifest=None):
+    """Prüft, ob alle in der Config genannten Dateien und Ordner existieren.
+
+    manifest (AssetManifest) beantwortet die Prüfungen aus dem einmaligen Ordner-Scan.
+    """
     missing_items = []
+    manifest = manifest or AssetManifest()
     
     # Pfade aus der Config für die Prüfung vorbereiten
     folder_bilder = config.get('folder_bilder', 'bilder')
     
     # 1. Verzeichnisse prüfen
     for key in ['folder_fonts', 'folder_bilder']:
-        path = os.path.join(BASE_DIR, config.get(key))
-        if not os.path.exists(path):
+        path = os.path.join(base_dir, config.get(key))
+        if not manifest.folder_exists(path):
             missing_items.append(f"Ordner: {path}")
 
-    # 2. Einzeldateien an der Wurzel prüfen
-    for key in ['source_html', 'source_css']:
-        path = os.path.join(BASE_DIR, config.get(key))
-        if not os.path.exists(path):
-            missing_items.append(f"Datei (Wurzel): {path}")
+    # 2. Einzeldateien an der Wurzel prüfen (source_html kann auch eine Liste bzw. ein Muster sein)
+    source_files = resolve_sources(config.get('source_html'), base_dir)
+    for path in source_files + [os.path.join(base_dir, config.get('source_css'))]:
+        if not manifest.isfile(path):
+            missing_items.append(f"Datei (Wurzel): {path}")
+    if not source_files:
+        missing_items.append(f"Keine Datei zu source_html: {config.get('source_html')}")
+
+    # Preface nur prüfen, wenn es nicht auf "none" steht
+    preface_file = config.get('preface', 'none')
+    if preface_file.lower() != "none":
+        preface_path = os.path.join(base_dir, preface_file)
+        if not manifest.isfile(preface_path):
+            missing_items.append(f"Preface-Datei: {preface_path}")
+
+    # 3. Das Cover-Bild im Bilder-Ordner prüfen (Der Fix)
+    cover_filename = config.get('cover_image')
+    # Wir kombinieren Basis-Ordner + Bilder-Ordner + Dateiname
+    cover_path = os.path.join(base_dir, folder_bilder, cover_filename)
+    
+    if not manifest.isfile(cover_path):
+        missing_items.append(f"Cover-Bild (im Bilder-Ordner): {cover_path}")
+    
+    if missing_items:
+        print("\n" + "!"*60)
+        print("KRITISCHE RESSOURCEN FEHLEN:")
+        for item in missing_items:
+            print(f" -> {item}")
+        print("!"*60 + "\n")
+        
+        # Abbruch-Bedingung
+        if not any(manifest.isfile(path) for path in source_files):
+            print("Abbruch: Quell-HTML fehlt.")
+            sys.exit(1)
+
+
+
+def _natural_key(path):
+    """Sortierschlüssel, der Zahlen als Zahlen vergleicht (tag2.html vor tag10.html)."""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', path)]
+
+
+def resolve_sources(source_html, base_dir):
+    """Die Quell-HTML Dateien in Buchreihenfolge.
+
+    source_html ist ein Dateiname, ein Muster ("tage/*.html", natürlich sortiert) oder
+    eine Liste davon. Jede Datei wird nur einmal übernommen.
+    """
+    patterns = source_html if isinstance(source_html, list) else [source_html]
+    files = []
+    for pattern in patterns:
+        path = os.path.join(base_dir, pattern)
+        if any(c in pattern for c in '*?['):
+            files.extend(sorted(glob.glob(path), key=_natural_key))
+        else:
+            files.append(path)
+    return list(dict.fromkeys(files))
+
+
+def get_font_mime(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    mapping = {'.ttf': 'font/ttf', '.otf': 'font/otf', '.woff': 'font/woff', '.woff2': 'font/woff2'}
+    return mapping.get(ext, 'application/vnd.ms-opentype')
+
+
+IMAGE_MIME = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.gif': 'image/gif',
+              '.webp': 'image/webp', '.svg': 'image/svg+xml'}
+
+
+def get_image_mime(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    return IMAGE_MIME.get(ext, 'image/jpeg')
+
+
+# HTML Gerüst eines Kapitels (flache Struktur: CSS ist einfach "hans.css")
+CHAPTER_TEMPLATE = '<html><head><link rel="stylesheet" href="hans.css" type="text/css"/></head><body></body></html>'
+
+
+def detach_children(tag):
+    """Löst alle direkten Kinder aus dem Tag und gibt sie in Originalreihenfolge zurück.
+
+    Es wird von hinten abgebaut und der Index mitgegeben. So ist jedes extract() O(1)
+    statt einer linearen Suche in tag.contents - wichtig bei sehr großen <body> Elementen.
+    """
+    nodes = []
+    for idx in range(len(tag.contents) - 1, -1, -1):
+        nodes.append(tag.contents[idx].extract(_self_index=idx))
+    nodes.reverse()
+    return nodes
+
+
+def assemble_chapter(section):
+    """Hängt die bereits geparsten Knoten einer Sektion in ein eigenes Kapitel-Dokument um.
+
+    Kein Umweg über str() und erneutes Parsen: die Knoten werden verschoben, nicht kopiert.
+    """
+    chap_soup = BeautifulSoup(CHAPTER_TEMPLATE, 'html.parser')
+    chap_body = chap_soup.body
+    for node in section:
+        chap_body.append(node)
+    return chap_soup
+
+
+# ------------------------------------------------------------------------------------------
+# HTML Parser-Backends und Kapitel-Sektionen
+# ------------------------------------------------------------------------------------------
+# Reihenfolge = Geschwindigkeit. "auto" nimmt das erste installierte Backend.
+PARSER_PREFERENCE = ['html5-parser', 'lxml', 'html.parser']
+PARSER_MODULES = {'html5-parser': 'html5_parser', 'lxml': 'lxml'}
+_module_status = {}
+
+# Elemente ohne End-Tag. Wichtig für die Tiefenzählung im Streaming-Modus.
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+                 'param', 'source', 'track', 'wbr'}
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def module_available(module):
+    """Prüft (einmalig), ob ein optionales Modul importiert werden kann."""
+    if module not in _module_status:
+        try:
+            importlib.import_module(module)
+            _module_status[module] = True
+        except Exception:                                                   # html5_parser wirft RuntimeError bei libxml2 Konflikten
+            _module_status[module] = False
+    return _module_status[module]
+
+
+def parser_available(name):
+    """Prüft, ob ein Parser-Backend importiert werden kann."""
+    if name == 'html.parser':
+        return True
+    return module_available(PARSER_MODULES[name])
+
+
+def resolve_parser(wanted):
+    """Liefert das zu nutzende Parser-Backend. 'auto' wählt das schnellste installierte."""
+    wanted = str(wanted or 'auto').lower()
+    if wanted == 'auto':
+        return next(p for p in PARSER_PREFERENCE if parser_available(p))
+    if wanted not in PARSER_PREFERENCE:
+        print(f"FEHLER: Unbekannter Parser '{wanted}'. Nutze html.parser.")
+        return 'html.parser'
+    if not parser_available(wanted):
+        print(f"HINWEIS: Parser '{wanted}' ist nicht installiert. Nutze html.parser.")
+        return 'html.parser'
+    return wanted
+
+
+def parse_html(markup, parser):
+    """Parst HTML mit dem gewählten Backend und liefert immer ein BeautifulSoup Objekt."""
+    if parser == 'html5-parser':
+        from html5_parser import parse
+        return parse(markup, treebuilder='soup', return_root=False)
+    return BeautifulSoup(markup, parser)
+
+
+def prepare_soup(soup):
+    """Entfernt <hide> Sektionen und ersetzt lokale iframes durch Bilder."""
+    # Erst die unerwünschten Sektionen löschen
+    for hide_tag in soup.find_all('hide'):
+        hide_tag.decompose()
+
+    # --- IFRAME ZU BILD WANDELN (START) ---
+    for iframe in soup.find_all('iframe'):
+        src = iframe.get('src', '')
+        if src:
+            # Extrahiert den Dateinamen (z.B. TAG05.html)
+            file_name_ext = os.path.basename(src)
+            if file_name_ext.lower().endswith('.html'):
+                # Ersetzt .html durch .jpg (z.B. TAG05.jpg)
+                new_img_name = os.path.splitext(file_name_ext)[0] + '.jpg'
+                
+                # Erstellt ein neues img-Tag
+                new_img = soup.new_tag('img', src=new_img_name)
+                
+                # Kopiert vorhandene Attribute (optional, falls width/height bleiben sollen)
+                if iframe.get('width'): new_img['width'] = iframe['width']
+                
+                # Ersetzt das iframe durch das neue img
+                iframe.replace_with(new_img)
+    # --- IFRAME ZU BILD WANDELN (ENDE) ---
+
+
+def split_sections(elements):
+    """Teilt die Top-Level Knoten des <body> an <break> Tags in Sektionen auf."""
+    sections = []
+    current_section = []
+    for element in elements:
+        if isinstance(element, Comment): continue
+        if isinstance(element, Tag) and element.name in ['hr']: continue        # Werfe die HR Elemente raus die du so dringend in der Webseite benötigst.
+        # if isinstance(element, Tag) and element.name in ['h1', 'h2']:         # Alternative Kapiteltrenner, 31.12.2025 außer Betrieb gesetzt. lässt sich mit break besser steuern.
+        if isinstance(element, Tag) and element.name in ['break']:
+            if current_section: sections.append(current_section)
+            current_section = [element]
+        else:
+            current_section.append(element)
+    if current_section: sections.append(current_section)
+    return sections
+
+
+class SectionSplitter(HTMLParser):
+    """Zerlegt den <body> schon beim Lesen an Top-Level <break> Tags in Quelltext-Fragmente.
+
+    Der Quelltext wird 1:1 weitergereicht (convert_charrefs=False), geparst wird später nur
+    das jeweilige Fragment. Damit liegt nie das ganze DOM im Speicher. spans enthält je
+    Fragment Anfang und Ende im Quelltext als getpos() (None = Body-Anfang bzw. Dateiende).
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.in_body = False
+        self.stack = []
+        self.buffer = []
+        self.fragments = []
+        self.spans = []
+        self._start = None
+
+    def _flush(self, pos=None):
+        if self.buffer:
+            self.fragments.append("".join(self.buffer))
+            self.spans.append((self._start, pos))
+            self.buffer = []
+        self._start = pos
+
+    def handle_starttag(self, tag, attrs):
+        if not self.in_body:
+            self.in_body = tag == 'body'
+            return
+        if tag == 'break' and not self.stack:
+            self._flush(self.getpos())
+        self.buffer.append(self.get_starttag_text())
+        if tag not in VOID_ELEMENTS:
+            self.stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if not self.in_body:
+            return
+        if tag == 'break' and not self.stack:
+            self._flush(self.getpos())
+        self.buffer.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if not self.in_body:
+            return
+        if tag == 'body':
+            self.stack = []
+            self.in_body = False
+            self._flush(self.getpos())
+            return
+        if tag in self.stack:
+            # Nicht geschlossene Kinder werden wie im DOM implizit mit geschlossen
+            while self.stack.pop() != tag:
+                pass
+        self.buffer.append(f"</{tag}>")
+
+    def handle_data(self, data):
+        if self.in_body: self.buffer.append(data)
+
+    def handle_entityref(self, name):
+        if self.in_body: self.buffer.append(f"&{name};")
+
+    def handle_charref(self, name):
+        if self.in_body: self.buffer.append(f"&#{name};")
+
+    def handle_comment(self, data):
+        if self.in_body: self.buffer.append(f"<!--{data}-->")
+
+    def handle_pi(self, data):
+        if self.in_body: self.buffer.append(f"<?{data}>")
+
+    def unknown_decl(self, data):
+        if self.in_body: self.buffer.append(f"<![{data}]>")
+
+    def close(self):
+        super().close()
+        self._flush()
+
+    def pop_fragments(self):
+        fragments, self.fragments = self.fragments, []
+        return fragments
+
+
+# ------------------------------------------------------------------------------------------
+# Asset-Manifest: Bilder- und Font-Ordner einmal scannen statt ein stat() je Zugriff
+# ------------------------------------------------------------------------------------------
+ASSET_SCAN_MIN_PARALLEL = 256                                               # kleinere Ordner lohnen keinen Thread-Pool
+
+
+def _entry_stat(entry):
+    """(Pfad, (Größe, mtime_ns)) eines os.DirEntry, None statt der Werte für Ordner und Fehler."""
+    try:
+        if entry.is_file():
+            st = entry.stat()
+            return entry.path, (st.st_size, st.st_mtime_ns)
+    except OSError:
+        pass
+    return entry.path, None
+
+
+class AssetManifest:
+    """Name, Größe und mtime aller Dateien der gescannten Ordner (folder_bilder, folder_fonts).
+
+    Jeder Ordner wird einmal mit os.scandir gelistet, alle späteren Prüfungen kommen aus dem
+    Speicher - auf Netzlaufwerken kostet jedes stat() Millisekunden. Was in einem gescannten Ordner
+    fehlt, gibt es nicht. Andere Pfade (z.B. Bilder relativ zur HTML) werden beim ersten Zugriff
+    einmal geprüft und gemerkt. workers > 1 holt die Attribute großer Ordner im Thread-Pool.
+    """
+    def __init__(self, folders=(), workers=0):
+        self.files = {}                                                     # normalisierter Pfad -> (Größe, mtime_ns) oder None
+        self.folders = {}                                                   # normalisierter Ordner -> [Dateinamen] oder None
+        for folder in folders:
+            self.scan(folder, workers)
+
+    @staticmethod
+    def normalize(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def scan(self, folder, workers=0):
+        """Listet einen Ordner (nicht rekursiv) einmalig ins Manifest."""
+        key = self.normalize(folder)
+        if key in self.folders:
+            return
+        try:
+            with os.scandir(folder) as entries:
+                entries = list(entries)
+        except OSError:                                                     # Ordner fehlt
+            self.folders[key] = None
+            return
+        if workers > 1 and len(entries) >= ASSET_SCAN_MIN_PARALLEL:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                stats = list(pool.map(_entry_stat, entries))
+        else:
+            stats = [_entry_stat(entry) for entry in entries]
+        names = []
+        for path, values in stats:
+            if values is not None:
+                self.files[self.normalize(path)] = values
+                names.append(os.path.basename(path))
+        self.folders[key] = sorted(names, key=_natural_key)
+
+    def folder_exists(self, folder):
+        key = self.normalize(folder)
+        return self.folders[key] is not None if key in self.folders else os.path.isdir(folder)
+
+    def stat(self, path):
+        """(Größe, mtime_ns) einer Datei oder None, wenn es sie nicht gibt."""
+        key = self.normalize(path)
+        if key not in self.files:
+            if os.path.dirname(key) in self.folders:
+                return None
+            try:
+                st = os.stat(path)
+                self.files[key] = (st.st_size, st.st_mtime_ns) if stat.S_ISREG(st.st_mode) else None
+            except OSError:
+                self.files[key] = None
+        return self.files[key]
+
+    def isfile(self, path):
+        return self.stat(path) is not None
+
+    def unused(self, folder, used_paths):
+        """Dateinamen im Ordner, deren normalisierter Pfad nicht in used_paths steht."""
+        return [name for name in self.folders.get(self.normalize(folder)) or []
+                if self.normalize(os.path.join(folder, name)) not in used_paths]
+
+
+ASSET_REPORT_LIMIT = 20                                                     # so viele Namen je Liste ausgeben
+
+
+def print_asset_report(missing, unused):
+    """Referenzierte, aber fehlende und vorhandene, aber ungenutzte Dateien."""
+    for level, label, names in (("HINWEIS", "referenzierte Dateien fehlen", missing),
+                                ("Info", "Dateien in Bilder-/Font-Ordner werden im Buch nicht genutzt", unused)):
+        if not names:
+            continue
+        print(f"{level}: {len(names)} {label}:")
+        for name in names[:ASSET_REPORT_LIMIT]:
+            print(f" -> {name}")
+        if len(names) > ASSET_REPORT_LIMIT:
+            print(f" -> ... und {len(names) - ASSET_REPORT_LIMIT} weitere")
+
+
+def preflight_assets(json_file_name=None, overrides=None):
+    """Prüft vor dem Build, ohne etwas zu parsen: welche Bilder/Fonts fehlen, welche sind ungenutzt.
+
+    Die Verweise kommen per Muster aus den Quell-HTML (img/a/iframe wie prepare_soup) und den
+    url() im CSS. Auch Bilder in <hide> Blöcken zählen als referenziert.
+    Rückgabe: Anzahl der fehlenden Dateien.
+    """
+    config_dict = {**load_json(json_file_name).get("config"), **(overrides or {})}
+    base_dir = os.path.dirname(os.path.abspath(json_file_name)) if json_file_name else BASE_DIR
+    manifest = open_manifest(config_dict, base_dir)
+    check_resources(config_dict, base_dir, manifest)
+    folder_bilder = os.path.join(base_dir, config_dict.get("folder_bilder"))
+    folder_fonts = os.path.join(base_dir, config_dict.get("folder_fonts"))
+    rendered = str(config_dict.get("iframe_render", "none")).lower() != "none"
+
+    used = {manifest.normalize(os.path.join(folder_bilder, config_dict.get("cover_image")))}
+    missing = []
+    for path in resolve_sources(config_dict.get("source_html"), base_dir):
+        if not manifest.isfile(path):
+            continue
+        iframes = set(find_iframe_sources(path))
+        for ref in scan_html(path, ASSET_REF):
+            is_iframe = ref in iframes and ref.lower().endswith('.html')
+            if is_iframe:
+                ref = os.path.splitext(os.path.basename(ref))[0] + '.jpg'
+            elif os.path.splitext(ref)[1].lower() not in IMAGE_MIME:
+                continue
+            local = resolve_local_image(ref, os.path.dirname(path), folder_bilder, manifest=manifest)
+            if local:
+                used.add(manifest.normalize(local))
+            elif not (is_iframe and rendered):                              # fehlende iframe-Bilder werden gerendert
+                missing.append(ref)
+    source_css = os.path.join(base_dir, config_dict.get("source_css"))
+    if manifest.isfile(source_css):
+        with open(source_css, 'r', encoding='utf-8') as f:
+            for url in re.findall(r'url\([\'"]?([^)\'"]+)[\'"]?\)', f.read()):
+                local_font = os.path.join(folder_fonts, os.path.basename(url.split('?')[0].split('#')[0]))
+                if manifest.isfile(local_font):
+                    used.add(manifest.normalize(local_font))
+                elif not url.startswith('data:'):
+                    missing.append(url)
+
+    missing = list(dict.fromkeys(missing))
+    unused = manifest.unused(folder_bilder, used) + manifest.unused(folder_fonts, used)
+    print_asset_report(missing, unused)
+    print(f"Asset-Prüfung: {len(missing)} fehlen, {len(unused)} ungenutzt.")
+    return len(missing)
+
+
+def open_manifest(config_dict, base_dir):
+    """Scannt folder_bilder und folder_fonts laut JSON (asset_scan_workers: Threads, 0 = einzeln)."""
+    return AssetManifest([os.path.join(base_dir, config_dict.get(key)) for key in ('folder_bilder', 'folder_fonts')],
+                         int(config_dict.get("asset_scan_workers", 0)))
+
+
+# ------------------------------------------------------------------------------------------
+# Ressourcen-Registry: alle Dateien im Buch (Bilder, Fonts, Cover)
+# ------------------------------------------------------------------------------------------
+class FileItem(epub.EpubItem):
+    """EpubItem, dessen Inhalt erst beim Schreiben von der Platte gelesen wird.
+
+    Ist content gesetzt (z.B. ein optimiertes Bild ohne Cache), hat content Vorrang.
+    """
+    def __init__(self, uid, file_name, media_type, source_path):
+        super().__init__(uid=uid, file_name=file_name, media_type=media_type)
+        self.source_path = source_path
+
+    def get_content(self, default=None):
+        if self.content:
+            return self.content
+        with open(self.source_path, 'rb') as f:
+            return f.read()
+
+
+def item_size(item):
+    """Größe eines Items in Bytes, ohne eine Datei dafür einzulesen."""
+    if isinstance(item, FileItem) and not item.content:
+        return os.path.getsize(item.source_path)
+    return len(item.get_content())
+
+
+def file_digest(path):
+    """SHA-1 und Größe einer Datei, blockweise gelesen."""
+    digest = hashlib.sha1()
+    size = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+
+class ResourceRegistry:
+    """Merkt sich jede Datei im Buch nach uid, Quellpfad, EPUB-Dateiname und Inhalt.
+
+    - Lookups über Dictionaries statt einer Liste aller book.items je Bild.
+    - Zwei verschiedene Dateien mit gleichem Dateinamen werden umbenannt (x.jpg -> x_2.jpg).
+    - Identischer Inhalt unter anderem Namen wird nur einmal gespeichert.
+    """
+    def __init__(self, book, reserved_names=(), profiler=None, digest_memo=None, manifest=None):
+        self.book = book
+        self.manifest = manifest or AssetManifest()                         # exists/Größe/mtime ohne erneutes stat()
+        self.profiler = profiler or NO_PROFILER                             # misst das Einlesen (Hash) der Dateien
+        self.digest_memo = digest_memo                                      # (Pfad, Größe, mtime) -> Hash, Watch-Modus
+        self.by_uid = {}
+        self.by_path = {}                                                   # normalisierter Quellpfad -> EpubItem
+        self.by_name = {name: None for name in reserved_names}              # EPUB file_name -> normalisierter Quellpfad
+        self.by_digest = {}                                                 # SHA-1 des Inhalts -> EpubItem
+        self.sources = {}                                                   # uid -> (Art, Quellpfad)
+        self.digests = {}                                                   # uid -> SHA-1 des Inhalts
+        self.dedup_hits = []                                                # (Quellpfad, genutzter file_name, Bytes)
+        self.collisions = []                                                # (Quellpfad, gewünschter Name, neuer Name)
+
+    @staticmethod
+    def normalize(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def get(self, path):
+        """Liefert das EpubItem zu einem Quellpfad oder None."""
+        return self.by_path.get(self.normalize(path))
+
+    def _unique_name(self, name, key):
+        if name not in self.by_name or self.by_name[name] == key:
+            return name
+        stem, ext = os.path.splitext(name)
+        counter = 2
+        while f"{stem}_{counter}{ext}" in self.by_name:
+            counter += 1
+        new_name = f"{stem}_{counter}{ext}"
+        self.collisions.append((key, name, new_name))
+        return new_name
+
+    def _unique_uid(self, uid):
+        candidate, counter = uid, 2
+        while candidate in self.by_uid:
+            candidate = f"{uid}_{counter}"
+            counter += 1
+        return candidate
+
+    def _remember(self, item, key, digest, kind, path):
+        self.by_uid[item.id] = item
+        self.sources[item.id] = (kind, path)
+        self.by_path[key] = item
+        self.by_name[item.file_name] = key
+        self.by_digest[digest] = item
+        self.digests[item.id] = digest
+
+    def add_file(self, path, uid_prefix, media_type, file_name=None):
+        """Fügt eine lokale Datei einmalig ins Buch ein und liefert das EpubItem."""
+        key = self.normalize(path)
+        item = self.by_path.get(key)
+        if item is not None:
+            return item
+
+        with self.profiler.phase('file_hash'):
+            digest, size = self._digest(path)
+        item = self.by_digest.get(digest)
+        if item is not None:
+            # Gleiche Bytes unter anderem Namen: auf das vorhandene Item verweisen
+            self.by_path[key] = item
+            self.dedup_hits.append((path, item.file_name, size))
+            return item
+
+        name = self._unique_name(file_name or os.path.basename(path), key)
+        uid = self._unique_uid(f"{uid_prefix}_{name.replace('.', '_')}")
+        # Der Inhalt bleibt auf der Platte, gelesen wird erst beim Schreiben
+        item = FileItem(uid, name, media_type, path)
+        self.book.add_item(item)
+        self._remember(item, key, digest, uid_prefix, path)
+        return item
+
+    def _digest(self, path):
+        """file_digest(), im Watch-Modus nur für neue oder geänderte Dateien."""
+        if self.digest_memo is None:
+            return file_digest(path)
+        memo_key = (path, *self.manifest.stat(path))
+        if memo_key not in self.digest_memo:
+            self.digest_memo[memo_key] = file_digest(path)
+        return self.digest_memo[memo_key]
+
+    def add_cover(self, path, file_name):
+        """Setzt das Cover über ebooklib und registriert das erzeugte Bild."""
+        with open(path, 'rb') as f:
+            content = f.read()
+        # set_cover macht zwei Dinge: Bild hinzufügen und als Cover markieren
+        self.book.set_cover(file_name, content)
+        item = self.book.get_item_with_id('cover-img')
+        self._remember(item, self.normalize(path), hashlib.sha1(content).hexdigest(), 'img', path)
+        return item
+
+    def reserve(self, path):
+        """Hält den Dateinamen einer vorhandenen Datei für diese frei, auch wenn sie erst später ins Buch kommt."""
+        if self.manifest.isfile(path):
+            self.by_name.setdefault(os.path.basename(path), self.normalize(path))
+
+    def rename(self, item, file_name, media_type=None):
+        """Ändert den Dateinamen eines Items (z.B. .ttf -> .woff2) und liefert den neuen Namen."""
+        key = self.by_name.pop(item.file_name, None)
+        item.file_name = self._unique_name(file_name, key)
+        self.by_name[item.file_name] = key
+        if media_type:
+            item.media_type = media_type
+        return item.file_name
+
+    def get_by_name(self, file_name):
+        """Liefert das Item zu einem Dateinamen im EPUB oder None."""
+        key = self.by_name.get(file_name)
+        return self.by_path.get(key) if key else None
+
+    def remove(self, item):
+        """Nimmt ein Item wieder aus dem Buch (z.B. ungenutzter Font)."""
+        self.book.items.remove(item)
+        self.by_uid.pop(item.id, None)
+        self.sources.pop(item.id, None)
+        self.by_name.pop(item.file_name, None)
+        for mapping in (self.by_path, self.by_digest):
+            for key in [k for k, v in mapping.items() if v is item]:
+                del mapping[key]
+
+    def items_of(self, kind):
+        """Liefert (EpubItem, Quellpfad) aller Dateien einer Art ('img', 'font')."""
+        return [(self.by_uid[uid], path) for uid, (k, path) in self.sources.items() if k == kind]
+
+    def report(self):
+        """Gibt Kollisionen und Duplikat-Treffer aus."""
+        print(f"Ressourcen im Buch: {len(self.by_uid)} Dateien")
+        for key, name, new_name in self.collisions:
+            print(f"HINWEIS: Namenskollision '{name}' -> gespeichert als '{new_name}' ({key})")
+        if self.dedup_hits:
+            saved = sum(size for _, _, size in self.dedup_hits)
+            print(f"Duplikate: {len(self.dedup_hits)} Dateien nur einmal gespeichert ({saved / 1024:.1f} KB gespart)")
+            for path, name, _ in self.dedup_hits:
+                print(f" -> {os.path.basename(path)} = {name}")
+
+
+# ------------------------------------------------------------------------------------------
+# Bild-Optimierung (optional, benötigt Pillow)
+# ------------------------------------------------------------------------------------------
+def parallel_map(func, tasks, workers=0):
+    """Führt func für alle Tasks aus - ab zwei Tasks im Prozess-Pool. Liefert die Ergebnisse der Reihe nach."""
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers <= 1:
+        yield from map(func, tasks)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(func, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
+
+
+PILLOW_FORMATS = {'JPEG': 'JPEG', 'MPO': 'JPEG', 'PNG': 'PNG', 'WEBP': 'WEBP'}  # Pillow-Format -> Format beim Speichern
+
+
+def optimize_image(task):
+    """Verkleinert/komprimiert ein Bild. Läuft im Prozess-Pool, daher nur einfache Typen.
+
+    task = (Pfad, max. Kantenlänge, Qualität, EXIF entfernen)
+    Rückgabe: (Pfad, Bytes, Originalgröße, neue Größe, Sekunden). Bytes ist None, wenn das Format
+    nicht optimiert wird (z.B. GIF) - das Original bleibt dann ungecacht im Buch.
+    MPO (Handy-/Kamera-JPEG mit mehreren Bildern) wird als JPEG aus dem ersten Bild neu geschrieben.
+    """
+    path, max_edge, quality, strip_exif = task
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        original = f.read()
+    data = original
+
+    from PIL import Image, ImageOps
+    try:
+        with Image.open(io.BytesIO(original)) as im:
+            fmt = PILLOW_FORMATS.get(im.format)
+            if fmt is None:
+                print(f"HINWEIS: {os.path.basename(path)}: Format {im.format} wird nicht optimiert, Original wird verwendet.")
+                return path, None, len(original), len(original), time.perf_counter() - start
+            if im.format == 'MPO':
+                im.seek(0)
+                im = im.copy()                                              # nur das erste Bild, ohne MPO-Anhang
+            exif = im.info.get('exif')
+            if strip_exif:
+                # Ausrichtung übernehmen, bevor die EXIF Daten verschwinden
+                im = ImageOps.exif_transpose(im)
+            resized = bool(max_edge) and max(im.size) > max_edge
+            if resized:
+                im.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            options = {'optimize': True}
+            if fmt in ('JPEG', 'WEBP'):
+                options['quality'] = quality or 90
+            if exif and not strip_exif:
+                options['exif'] = exif
+            out = io.BytesIO()
+            im.save(out, format=fmt, **options)
+            # Ohne Verkleinerung und ohne EXIF-Wunsch nur übernehmen, wenn es wirklich kleiner wird
+            if resized or strip_exif or out.tell() < len(original):
+                data = out.getvalue()
+    except Exception as e:
+        print(f"FEHLER bei Bildoptimierung {os.path.basename(path)} ({e}). Original wird verwendet.")
+        data = original
+    return path, data, len(original), len(data), time.perf_counter() - start
+
+
+def optimize_images(registry, max_edge, quality, strip_exif, workers=0, cache=None):
+    """Optimiert alle Bilder der Registry parallel und liefert den Bericht je Bild.
+
+    Mit Cache werden nur Bilder gerechnet, deren Inhalt oder Einstellungen neu sind.
+    """
+    if not (max_edge or quality or strip_exif):
+        return []
+    if not module_available('PIL'):
+        print("HINWEIS: Bildoptimierung konfiguriert, aber Pillow ist nicht installiert (pip install Pillow).")
+        return []
+
+    report = []
+    items_by_path = {}
+    cache_keys = {}
+    tasks = []
+    for item, path in registry.items_of('img'):
+        if cache is not None:
+            key = cache.key('image', registry.digests[item.id], max_edge, quality, strip_exif)
+            cached_path = cache.get_path(key)
+            if cached_path is not None:
+                report.append((item.file_name, os.path.getsize(path), os.path.getsize(cached_path), 0.0))
+                _set_item_data(item, cached_path=cached_path)
+                continue
+            cache_keys[path] = key
+        items_by_path[path] = item
+        tasks.append((path, max_edge, quality, strip_exif))
+    if not tasks:
+        return report
+
+    def collect(results):
+        # Ergebnisse einzeln übernehmen; mit Cache landen die Bytes sofort auf der Platte
+        for path, data, old_size, new_size, seconds in results:
+            item = items_by_path[path]
+            if data is None:
+                report.append((item.file_name, old_size, new_size, seconds))
+                continue                                                    # nicht optimierbar: Original bleibt, kein Cache
+            if path in cache_keys:
+                _set_item_data(item, cached_path=cache.put(cache_keys[path], data))
+            else:
+                _set_item_data(item, data=data)
+            report.append((item.file_name, old_size, new_size, seconds))
+
+    collect(parallel_map(optimize_image, tasks, workers))
+    return report
+
+
+def _set_item_data(item, data=None, cached_path=None):
+    """Hängt das Ergebnis (Bild, Font) an das Item: als Datei im Cache oder als Bytes."""
+    if cached_path is not None and isinstance(item, FileItem):
+        item.source_path = cached_path
+        item.content = b''
+    elif data is not None:
+        item.content = data
+    else:
+        with open(cached_path, 'rb') as f:
+            item.content = f.read()
+
+
+def print_image_report(report):
+    """Gibt Größe und Zeit je optimiertem Bild aus."""
+    if not report:
+        return
+    print("\nBild-Optimierung:")
+    print(f"  {'Datei':40s} {'vorher KB':>10s} {'nachher KB':>10s} {'ms':>8s}")
+    for name, old_size, new_size, seconds in sorted(report):
+        timing = f"{seconds * 1000:8.1f}" if seconds else f"{'Cache':>8s}"
+        print(f"  {name[:40]:40s} {old_size / 1024:10.1f} {new_size / 1024:10.1f} {timing}")
+    total_old = sum(r[1] for r in report)
+    total_new = sum(r[2] for r in report)
+    print(f"  Summe: {total_old / 1024 / 1024:.1f} MB -> {total_new / 1024 / 1024:.1f} MB")
+
+
+# ------------------------------------------------------------------------------------------
+# iframe-Snapshots: lokale iframe-Seiten (Karten) mit einem Headless-Browser als Bild rendern
+# ------------------------------------------------------------------------------------------
+IFRAME_SRC = re.compile(r'<iframe\b[^>]*?\bsrc\s*=\s*["\']([^"\']+)["\']', re.I)
+ASSET_REF = re.compile(r'\b(?:src|href)\s*=\s*["\']([^"\'#?:]+)["\']', re.I)   # nur relative Pfade
+RENDERER_CANDIDATES = [
+    "chromium", "chromium-browser", "google-chrome", "chrome", "msedge", "wkhtmltoimage",
+    r"C:\Program Files\Google\Chrome\Application\chrome.exe",
+    r"C:\Program Files (x86)\Microsoft\Edge\Application\msedge.exe",
+    r"C:\Program Files\wkhtmltopdf\bin\wkhtmltoimage.exe",
+]
+RENDER_TIMEOUT = 60                                                         # Sekunden je Seite (zusätzlich zur Wartezeit)
+
+
+def scan_html(source_html, pattern):
+    """Alle Treffer eines Tag-Musters in der Quell-HTML, blockweise gelesen (auch im Streaming-Modus günstig)."""
+    found = []
+    tail = ""
+    with open(source_html, 'r', encoding='utf-8') as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), ''):
+            text = tail + chunk
+            cut = text.rfind('<')                                           # angefangenes Tag im nächsten Block prüfen
+            text, tail = (text[:cut], text[cut:]) if cut >= 0 else (text, "")
+            found.extend(pattern.findall(text))
+    found.extend(pattern.findall(tail))
+    return list(dict.fromkeys(found))
+
+
+def find_iframe_sources(source_html):
+    """Alle iframe src der Quell-HTML."""
+    return scan_html(source_html, IFRAME_SRC)
+
+
+def resolve_renderer(wanted):
+    """Liefert (Programm, Art) für "auto", einen Namen oder einen Pfad, sonst None."""
+    candidates = RENDERER_CANDIDATES if wanted.lower() == "auto" else [wanted]
+    for candidate in candidates:
+        program = shutil.which(candidate) or (candidate if os.path.isfile(candidate) else None)
+        if program:
+            kind = 'wkhtmltoimage' if 'wkhtmltoimage' in os.path.basename(program).lower() else 'chromium'
+            return program, kind
+    return None
+
+
+def _snapshot_key(html_path, renderer_kind, width, height, delay):
+    """Hash aus iframe-Seite, ihren lokalen Dateien (Skripte, CSS, GPX ...) und den Render-Optionen."""
+    digest = hashlib.sha256(f"{renderer_kind}:{width}x{height}:{delay}".encode('utf-8'))
+    with open(html_path, 'rb') as f:
+        page = f.read()
+    digest.update(page)
+    folder = os.path.dirname(html_path)
+    for ref in sorted(set(ASSET_REF.findall(page.decode('utf-8', errors='replace')))):
+        asset = os.path.join(folder, ref)
+        if os.path.isfile(asset):
+            digest.update(f"\0{ref}\0{file_digest(asset)[0]}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def render_iframe(task):
+    """Rendert eine lokale iframe-Seite (läuft im Thread-Pool, der Browser ist ein eigener Prozess)."""
+    program, kind, html_path, out_path, width, height, delay = task
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    if kind == 'wkhtmltoimage':
+        shot = out_path + '.tmp.jpg'
+        cmd = [program, '--quiet', '--enable-local-file-access', '--width', str(width), '--height', str(height),
+               '--javascript-delay', str(delay), '--quality', '85', html_path, shot]
+    else:
+        shot = out_path + '.tmp.png'
+        cmd = [program, '--headless', '--disable-gpu', '--hide-scrollbars', f'--window-size={width},{height}',
+               f'--virtual-time-budget={delay}', f'--screenshot={shot}', Path(html_path).as_uri()]
+        if hasattr(os, 'geteuid') and os.geteuid() == 0:
+            cmd.insert(1, '--no-sandbox')                                   # Chromium verweigert sonst den Start als root
+    try:
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True,
+                       timeout=RENDER_TIMEOUT + delay / 1000)
+        if not os.path.isfile(shot):
+            raise OSError("kein Bild erzeugt")
+        if shot.endswith('.png') and out_path.endswith('.jpg'):
+            from PIL import Image
+            with Image.open(shot) as img:
+                img.convert('RGB').save(out_path, 'JPEG', quality=85, optimize=True)
+            os.remove(shot)
+        else:
+            os.replace(shot, out_path)
+    except (OSError, subprocess.SubprocessError) as e:
+        if os.path.exists(shot):
+            os.remove(shot)
+        if isinstance(e, subprocess.CalledProcessError):
+            error = f"Exit-Code {e.returncode}"
+        elif isinstance(e, subprocess.TimeoutExpired):
+            error = f"Zeitüberschreitung nach {e.timeout:.0f} s"
+        else:
+            error = str(e)
+        return {'source': html_path, 'path': out_path, 'error': error}
+    return {'source': html_path, 'path': out_path, 'error': None}
+
+
+def render_iframes(sources, folder_bilder, config_dict, cache=None, manifest=None):
+    """Rendert jede lokale iframe-Seite ohne fertiges Bild im Bilder-Ordner (parallel, gecacht).
+
+    sources: (Ordner der Quell-HTML, iframe src) je iframe.
+    Rückgabe: {Bildname aus prepare_soup (TAG05.jpg): Pfad des Snapshots}. Ein von Hand
+    erstelltes Bild hat immer Vorrang. Snapshots liegen im Cache-Ordner unter iframes/<Hash>/,
+    eine geänderte Karte (oder eine ihrer lokalen Dateien) ergibt also einen neuen Snapshot.
+    """
+    wanted = str(config_dict.get("iframe_render", "none"))
+    if wanted.lower() == "none":
+        return {}
+    renderer = resolve_renderer(wanted)
+    if renderer is None:
+        print(f"HINWEIS: Kein Renderer für iframes gefunden ({wanted}), iframes ohne Bild bleiben leer.")
+        return {}
+    program, kind = renderer
+    width = int(config_dict.get("iframe_width", 1024))
+    height = int(config_dict.get("iframe_height", 768))
+    delay = int(config_dict.get("iframe_delay_ms", 2000))
+    ext = '.jpg' if kind == 'wkhtmltoimage' or module_available('PIL') else '.png'
+    root = os.path.join(cache.folder, 'iframes') if cache else os.path.join(tempfile.gettempdir(), 'epub_iframes')
+
+    snapshots = {}
+    tasks = []
+    cached = 0
+    for base_dir, src in dict.fromkeys(sources):
+        if '://' in src or not src.lower().endswith('.html'):
+            continue                                                        # wie prepare_soup: nur lokale .html Seiten
+        img_name = os.path.splitext(os.path.basename(src))[0] + '.jpg'
+        if resolve_local_image(img_name, base_dir, folder_bilder, manifest=manifest):
+            continue                                                        # von Hand erstelltes Bild
+        html_path = os.path.join(base_dir, src)
+        if not os.path.isfile(html_path):
+            print(f"HINWEIS: iframe-Seite nicht gefunden: {src}")
+            continue
+        key = _snapshot_key(html_path, kind, width, height, delay)
+        out_path = os.path.join(root, key[:16], os.path.splitext(img_name)[0] + ext)
+        snapshots[img_name] = out_path
+        if os.path.isfile(out_path):
+            os.utime(out_path)                                              # LRU wie im BuildCache
+            cached += 1
+        else:
+            tasks.append((program, kind, html_path, out_path, width, height, delay))
+
+    if tasks:
+        workers = int(config_dict.get("image_workers", 0)) or os.cpu_count() or 1
+        print(f"Rendere {len(tasks)} iframe-Seiten mit {os.path.basename(program)} ...")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            results = list(pool.map(render_iframe, tasks))
+        failed = set()
+        for r in results:
+            if r['error']:
+                print(f"FEHLER: iframe {os.path.basename(r['source'])} nicht gerendert: {r['error']}")
+                failed.add(r['path'])
+        snapshots = {name: path for name, path in snapshots.items() if path not in failed}
+        print(f"iframe-Snapshots: {len(results) - len(failed)} gerendert ({time.perf_counter() - start:.1f} s), "
+              f"{cached} aus dem Cache.")
+    elif snapshots:
+        print(f"iframe-Snapshots: {cached} aus dem Cache.")
+    return snapshots
+
+
+# ------------------------------------------------------------------------------------------
+# Font-Subsetting (optional, benötigt fontTools, für WOFF2 zusätzlich brotli)
+# ------------------------------------------------------------------------------------------
+SUBSET_FONT_EXTENSIONS = ('.ttf', '.otf', '.woff', '.woff2')
+# Zeichen, die immer im Font bleiben (Leerzeichen, Ziffern, Satzzeichen für Seitenzahlen usw.)
+SUBSET_ALWAYS = " 0123456789.,:;-–!?\"'()/\u00a0"
+CSS_FORMATS = {'font/woff2': 'woff2', 'font/woff': 'woff', 'font/ttf': 'truetype', 'font/otf': 'opentype'}
+
+
+def css_content_chars(css_content):
+    """Zeichen aus content: "..." Angaben im CSS (z.B. Icons wie "\\f007")."""
+    chars = set()
+    for value in re.findall(r'content\s*:\s*(["\'])(.*?)\1', css_content):
+        text = re.sub(r'\\([0-9a-fA-F]{1,6})\s?', lambda m: chr(int(m.group(1), 16)), value[1])
+        chars.update(text)
+    return chars
+
+
+CSS_CASE_CHANGE = re.compile(r'text-transform\s*:\s*(?:uppercase|lowercase|capitalize)|font-variant(?:-caps)?\s*:[^;}]*caps', re.I)
+
+
+def css_case_chars(css_content, chars):
+    """Groß- und Kleinbuchstaben zu chars, wenn das CSS die Schreibweise ändert (text-transform,
+    small-caps). Sonst fehlen im reduzierten Font genau die angezeigten Zeichen."""
+    if not CSS_CASE_CHANGE.search(css_content):
+        return set()
+    variants = set()
+    for c in chars:
+        variants.update(c.upper())                                          # "ß".upper() == "SS"
+        variants.update(c.lower())
+    return variants
+
+
+def subset_font(task):
+    """Reduziert einen Font auf die übergebenen Codepoints. Läuft im Prozess-Pool.
+
+    task = (Pfad, Codepoints, WOFF2)
+    Rückgabe: (Pfad, Bytes oder None bei Fehler, Originalgröße, neue Größe, Sekunden)
+    """
+    path, codepoints, woff2 = task
+    start = time.perf_counter()
+    from fontTools import subset
+    from fontTools.ttLib import TTFont
+    original_size = os.path.getsize(path)
+    try:
+        options = subset.Options()
+        options.layout_features = ['*']                                     # Kerning, Ligaturen usw. behalten
+        options.name_IDs = ['*']
+        options.notdef_outline = True
+        font = TTFont(path, recalcTimestamp=False)                          # head.modified bleibt, sonst jedes Mal andere Bytes
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(unicodes=codepoints)
+        subsetter.subset(font)
+        if woff2:
+            font.flavor = 'woff2'
+        out = io.BytesIO()
+        font.save(out)
+        data = out.getvalue()
+    except Exception as e:
+        print(f"FEHLER beim Font-Subsetting {os.path.basename(path)} ({e}). Original wird verwendet.")
+        return path, None, original_size, original_size, time.perf_counter() - start
+    return path, data, original_size, len(data), time.perf_counter() - start
+
+
+def subset_fonts(registry, chars, css_content, woff2=False, workers=0, cache=None):
+    """Reduziert alle eingebetteten Fonts auf die genutzten Zeichen.
+
+    Liefert das angepasste CSS (bei WOFF2 ändern sich Dateinamen und format()) und den Bericht.
+    """
+    if not module_available('fontTools'):
+        print("HINWEIS: font_subset konfiguriert, aber fontTools ist nicht installiert (pip install fonttools).")
+        return css_content, []
+    if woff2 and not module_available('brotli'):
+        print("HINWEIS: font_woff2 benötigt brotli (pip install brotli). Fonts bleiben im Originalformat.")
+        woff2 = False
+
+    codepoints = sorted({ord(c) for c in set(chars) | set(SUBSET_ALWAYS)})
+    codepoint_hash = hashlib.sha1(",".join(map(str, codepoints)).encode('ascii')).hexdigest()
+    report = []
+    items_by_path = {}
+    cache_keys = {}
+    tasks = []
+    renames = []
+    for item, path in registry.items_of('font'):
+        if not item.file_name.lower().endswith(SUBSET_FONT_EXTENSIONS):
+            continue
+        if cache is not None:
+            key = cache.key('font', registry.digests[item.id], codepoint_hash, woff2)
+            cached_path = cache.get_path(key)
+            if cached_path is not None:
+                report.append((item.file_name, os.path.getsize(path), os.path.getsize(cached_path), 0.0))
+                _set_item_data(item, cached_path=cached_path)
+                if woff2: renames.append(item)
+                continue
+            cache_keys[path] = key
+        items_by_path[path] = item
+        tasks.append((path, codepoints, woff2))
+
+    for path, data, old_size, new_size, seconds in parallel_map(subset_font, tasks, workers):
+        item = items_by_path[path]
+        report.append((item.file_name, old_size, new_size, seconds))
+        if data is None:
+            continue                                                        # Fehler: Original bleibt im Buch
+        if path in cache_keys:
+            _set_item_data(item, cached_path=cache.put(cache_keys[path], data))
+        else:
+            _set_item_data(item, data=data)
+        if woff2: renames.append(item)
+
+    # WOFF2: Dateiname, Media-Type und format() im CSS anpassen
+    for item in renames:
+        old_name = item.file_name
+        if old_name.lower().endswith('.woff2'):
+            continue
+        new_name = registry.rename(item, os.path.splitext(old_name)[0] + '.woff2', 'font/woff2')
+        pattern = r'(url\(\s*[\'"]?)' + re.escape(old_name) + r'([\'"]?\s*\))(\s*format\(\s*[\'"]?)?([\w-]+)?'
+        def replace(m, new_name=new_name):
+            fmt = f"{m.group(3)}woff2" if m.group(3) else ""
+            return f"{m.group(1)}{new_name}{m.group(2)}{fmt}"
+        css_content = re.sub(pattern, replace, css_content)
+    return css_content, report
+
+
+def print_font_report(report):
+    """Gibt Größe und Zeit je Font aus."""
+    if not report:
+        return
+    print("\nFont-Subsetting:")
+    print(f"  {'Datei':40s} {'vorher KB':>10s} {'nachher KB':>10s} {'ms':>8s}")
+    for name, old_size, new_size, seconds in sorted(report):
+        timing = f"{seconds * 1000:8.1f}" if seconds else f"{'Cache':>8s}"
+        print(f"  {name[:40]:40s} {old_size / 1024:10.1f} {new_size / 1024:10.1f} {timing}")
+
+
+# ------------------------------------------------------------------------------------------
+# CSS-Pruning: nur Regeln behalten, deren Selektoren in den Kapiteln vorkommen
+# ------------------------------------------------------------------------------------------
+# Zustände und Pseudo-Elemente, die im statischen DOM nie "matchen" - für den Test entfernt
+CSS_DYNAMIC_PSEUDO = re.compile(
+    r'::?(?:before|after|first-letter|first-line|selection|marker|placeholder|backdrop|hover|focus'
+    r'|focus-within|focus-visible|active|visited|link|target|-[\w-]+)(?![\w(-])', re.I)
+CSS_GROUP_RULES = ('@media', '@supports', '@layer', '@container', '@document')
+
+
+def _skip_css_string(text, i):
+    quote = text[i]
+    i += 1
+    while i < len(text) and text[i] != quote:
+        i += 2 if text[i] == '\\' else 1
+    return i + 1
+
+
+def css_blocks(text):
+    """Zerlegt CSS in Top-Level Blöcke: Liste aus (Prelude, Body oder None).
+
+    Kommentare und Strings werden beachtet, verschachtelte Blöcke (@media) bleiben als Body-Text.
+    """
+    blocks = []
+    start = i = 0
+    n = len(text)
+    while i < n:
+        if text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+        elif text[i] in '"\'':
+            i = _skip_css_string(text, i)
+        elif text[i] == ';':                                                # @import, @charset ...
+            prelude = re.sub(r'/\*.*?\*/', '', text[start:i], flags=re.S).strip()
+            if prelude: blocks.append((prelude, None))
+            start = i = i + 1
+        elif text[i] == '{':
+            depth, j = 1, i + 1
+            while j < n and depth:
+                if text.startswith('/*', j):
+                    end = text.find('*/', j + 2)
+                    j = n if end < 0 else end + 2
+                    continue
+                if text[j] in '"\'':
+                    j = _skip_css_string(text, j)
+                    continue
+                depth += {'{': 1, '}': -1}.get(text[j], 0)
+                j += 1
+            prelude = re.sub(r'/\*.*?\*/', '', text[start:i], flags=re.S).strip()
+            blocks.append((prelude, text[i + 1:j - 1]))
+            start = i = j
+        elif text[i] == '}':                                                # verwaiste Klammer
+            start = i = i + 1
+        else:
+            i += 1
+    return blocks
+
+
+def split_selectors(prelude):
+    """Teilt eine Selektor-Liste an Kommas außerhalb von Klammern."""
+    parts, depth, current = [], 0, []
+    for c in prelude:
+        if c in '([': depth += 1
+        elif c in ')]': depth -= 1
+        if c == ',' and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+        else:
+            current.append(c)
+    parts.append("".join(current).strip())
+    return [p for p in parts if p]
+
+
+def _media_is_wide_screen(prelude, min_width):
+    """True, wenn jede Query des @media Blocks eine Mindestbreite >= min_width px verlangt."""
+    for query in prelude[len('@media'):].split(','):
+        m = re.search(r'min-width\s*:\s*([\d.]+)\s*(px|em|rem)?', query, re.I)
+        if not m:
+            return False
+        width = float(m.group(1)) * (16 if (m.group(2) or 'px').lower() in ('em', 'rem') else 1)
+        if width < min_width:
+            return False
+    return True
+
+
+def _font_face_family(body):
+    m = re.search(r'font-family\s*:\s*([^;]+)', body, re.I)
+    return m.group(1).strip().strip('\'"').lower() if m else None
+
+
+class CssPruner:
+    """Ermittelt, welche CSS-Regeln in den fertigen Kapiteln greifen, und entfernt den Rest.
+
+    Ablauf: beim Rendern jedes Kapitels scan(soup), am Ende prune(registry).
+    Selektoren, die soupsieve nicht versteht, bleiben vorsichtshalber erhalten.
+    """
+    def __init__(self, css_content, media_min_width=1024):
+        self.css = css_content
+        self.media_min_width = media_min_width
+        self.patterns = {}                                                  # Selektor -> kompiliertes Muster
+        self.matched = set()
+        self.inline_styles = []                                             # style="..." mit Font-Angaben
+        self._collect(css_blocks(css_content))
+        self.pending = dict(self.patterns)
+
+    def _collect(self, blocks):
+        for prelude, body in blocks:
+            if body is None:
+                continue
+            if prelude.lower().startswith(CSS_GROUP_RULES):
+                self._collect(css_blocks(body))
+            elif not prelude.startswith('@'):
+                for selector in split_selectors(prelude):
+                    if selector in self.patterns or selector in self.matched:
+                        continue
+                    test = CSS_DYNAMIC_PSEUDO.sub('', selector).strip()
+                    if not test or test[-1] in '>+~':
+                        test = (test + ' *').strip()
+                    try:
+                        self.patterns[selector] = soupsieve.compile(test)
+                    except Exception:
+                        self.matched.add(selector)                          # unbekannt: behalten
+
+    def scan(self, soup):
+        """Markiert alle Selektoren, die im Kapitel mindestens ein Element treffen."""
+        for selector, pattern in list(self.pending.items()):
+            if pattern.select_one(soup) is not None:
+                self.matched.add(selector)
+                del self.pending[selector]
+        for tag in soup.find_all(style=re.compile('font', re.I)):
+            self.inline_styles.append(tag['style'])
+
+    def _prune_blocks(self, blocks, out, font_faces):
+        for prelude, body in blocks:
+            lower = prelude.lower()
+            if body is None:
+                out.append(f"{prelude};\n")
+            elif lower.startswith('@media') and self.media_min_width and \
+                    _media_is_wide_screen(prelude, self.media_min_width):
+                continue                                                    # Desktop-Layout
+            elif lower.startswith(CSS_GROUP_RULES):
+                inner = []
+                self._prune_blocks(css_blocks(body), inner, font_faces)
+                if inner:
+                    out.append(f"{prelude} {{\n{''.join(inner)}}}\n")
+            elif lower.startswith('@font-face'):
+                font_faces.append((len(out), prelude, body))
+                out.append(None)                                            # Platzhalter, Entscheidung später
+            elif prelude.startswith('@') or any(sel in self.matched for sel in split_selectors(prelude)):
+                out.append(f"{prelude} {{{body}}}\n")
+
+    def prune(self, registry):
+        """Liefert das reduzierte CSS und entfernt ungenutzte Fonts aus dem Buch.
+
+        Rückgabe: (CSS, Anzahl ungenutzter Selektoren, entfernte Fonts [(Name, Bytes)])
+        """
+        out, font_faces = [], []
+        self._prune_blocks(css_blocks(self.css), out, font_faces)
+
+        # Font-Familien, die in den verbliebenen Regeln oder inline genutzt werden
+        declarations = " ".join(re.findall(r'font(?:-family)?\s*:\s*([^;}]+)', "".join(filter(None, out)) +
+                                           ";".join(self.inline_styles), re.I)).lower()
+        kept_urls, dropped_urls = set(), set()
+        for index, prelude, body in font_faces:
+            family = _font_face_family(body)
+            urls = set(re.findall(r'url\(\s*[\'"]?([^)\'"]+)', body))
+            if family is None or family in declarations:
+                out[index] = f"{prelude} {{{body}}}\n"
+                kept_urls |= urls
+            else:
+                dropped_urls |= urls
+
+        removed_fonts = []
+        for url in dropped_urls - kept_urls:
+            item = registry.get_by_name(url)
+            if item is not None:
+                removed_fonts.append((url, item_size(item)))
+                registry.remove(item)
+        return "".join(filter(None, out)), len(self.pending), removed_fonts
+
+
+def resolve_local_image(src, base_dir, folder_bilder, snapshots=None, manifest=None):
+    """Sucht die lokale Datei zu einem Bild-Link. Zuerst flach im Bilder-Ordner, dann relativ zur HTML,
+    zuletzt unter den gerenderten iframe-Snapshots. manifest (AssetManifest) spart die stat() Aufrufe.
+
+    Gibt es beide Dateien mit unterschiedlichem Inhalt, gewinnt die relative (sub/a.jpg): der Link
+    meint genau diese Datei. _add_image speichert sie dann unter eigenem Namen (a_2.jpg)."""
+    isfile = manifest.isfile if manifest else os.path.isfile
+    f_name = os.path.basename(src) # Nur der Dateiname, z.B. TAG05.jpg
+    flat_img = os.path.join(folder_bilder, f_name)
+    flat = f_name and isfile(flat_img)
+    if src and '://' not in src and not os.path.isabs(src):
+        local_img = os.path.join(base_dir, src)
+        if isfile(local_img) and not (flat and _same_file(local_img, flat_img)):
+            return local_img
+    if flat:
+        return flat_img
+    if snapshots and f_name in snapshots:
+        return snapshots[f_name]
+    return None
+
+
+def _same_file(path_a, path_b):
+    """True, wenn beide Pfade auf dieselbe Datei oder auf gleichen Inhalt zeigen."""
+    if os.path.normcase(os.path.abspath(path_a)) == os.path.normcase(os.path.abspath(path_b)):
+        return True
+    return filecmp.cmp(path_a, path_b, shallow=False)                       # filecmp merkt sich das Ergebnis
+
+
+def _fragment_sections(fragment, parser, profiler=None):
+    """Parst ein einzelnes Body-Fragment und liefert dessen Sektion(en)."""
+    profiler = profiler or NO_PROFILER
+    # In <body> einbetten, sonst verpackt lxml losen Text in <p>
+    with profiler.phase('parse'):
+        soup = parse_html(f"<html><body>{fragment}</body></html>", parser)
+    with profiler.phase('prepare'):
+        prepare_soup(soup)
+    with profiler.phase('split'):
+        return split_sections(detach_children(soup.body))
+
+
+class Section:
+    """Eine <break> Sektion der Quell-HTML.
+
+    Im Streaming-Modus liegt nur der Quelltext vor; geparst wird erst beim Zugriff auf
+    nodes. Ein Cache-Treffer über key spart damit auch das Parsen.
+    """
+    def __init__(self, nodes=None, fragment=None, parser=None, profiler=None):
+        self._nodes = nodes
+        self.fragment = fragment
+        self.parser = parser
+        self.profiler = profiler
+        self._key = None
+
+    @property
+    def nodes(self):
+        if self._nodes is None:
+            # Ein Fragment beginnt mit <break> und ergibt höchstens eine Sektion
+            self._nodes = [node for section in _fragment_sections(self.fragment, self.parser, self.profiler)
+                           for node in section]
+            self.fragment = None
+        return self._nodes
+
+    @property
+    def key(self):
+        """Inhalts-Hash der Sektion (Quelltext im Streaming-Modus, sonst serialisierte Knoten)."""
+        if self._key is None:
+            digest = hashlib.sha256()
+            if self._nodes is None:
+                digest.update(b'fragment:' + self.fragment.encode('utf-8'))
+            else:
+                digest.update(b'nodes:')
+                for node in self._nodes:
+                    digest.update(str(node).encode('utf-8'))
+            self._key = digest.hexdigest()
+        return self._key
+
+
+def iter_sections(source_html, parser, streaming=False, profiler=None):
+    """Liefert die Kapitel-Sektionen (Section) der Quell-HTML nacheinander.
+
+    streaming=False: das ganze Dokument wird einmal geparst (schnellster Weg).
+    streaming=True:  die Datei wird blockweise gelesen und jede <break> Sektion sofort
+                     einzeln geparst - der Speicherbedarf richtet sich nach der größten Sektion.
+    """
+    profiler = profiler or NO_PROFILER
+    if not streaming:
+        with profiler.phase('parse'):
+            with open(source_html, 'r', encoding='utf-8') as f:
+                soup = parse_html(f.read(), parser)
+        with profiler.phase('prepare'):
+            prepare_soup(soup)
+        with profiler.phase('split'):
+            body = soup.find('body')
+            # Die Knoten werden einmal aus dem <body> gelöst und später direkt in die Kapitel umgehängt
+            sections = split_sections(detach_children(body))
+        for nodes in sections:
+            yield Section(nodes=nodes)
+        return
+
+    splitter = SectionSplitter()
+    with open(source_html, 'r', encoding='utf-8') as f:
+        while True:
+            chunk = f.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            splitter.feed(chunk)
+            for fragment in splitter.pop_fragments():
+                yield Section(fragment=fragment, parser=parser, profiler=profiler)
+    splitter.close()
+    for fragment in splitter.pop_fragments():
+        yield Section(fragment=fragment, parser=parser, profiler=profiler)
+
+
+def iter_source_sections(source_files, parser, streaming=False, profiler=None, session=None):
+    """Liefert (Ordner der Datei, Section) für alle Quell-Dateien nacheinander.
+
+    Jede Datei beginnt ein neues Kapitel und wird erst geparst, wenn ihre Kapitel an der
+    Reihe sind; ihr DOM wird danach wieder freigegeben. Der Speicherbedarf richtet sich
+    damit nach der größten Datei, nicht nach dem ganzen Buch.
+    """
+    for source_html in source_files:
+        if not os.path.exists(source_html):
+            continue                                                        # bereits von check_resources gemeldet
+        if session:
+            sections = session.sections(source_html, parser, profiler)     # nur geänderte Sektionen neu zerlegen
+        else:
+            sections = iter_sections(source_html, parser, streaming, profiler)
+        html_dir = os.path.dirname(source_html)
+        for section in sections:
+            yield html_dir, section
+
+
+# ------------------------------------------------------------------------------------------
+# Build-Cache: Ergebnisse nach Inhalts-Hash auf der Platte, Größe begrenzt (LRU)
+# ------------------------------------------------------------------------------------------
+CACHE_VERSION = "1"
+
+
+def _script_fingerprint():
+    """Ändert sich das Skript, sind alle Cache-Einträge ungültig."""
+    try:
+        with open(os.path.abspath(__file__), 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:                                                         # z.B. in der kompilierten EXE
+        return CACHE_VERSION
+
+
+class BuildCache:
+    """Content-adressierter Cache. Schlüssel = Hash aus Inhalt und relevanter Konfiguration.
+
+    Jeder Treffer setzt die mtime der Datei neu; beim Aufräumen werden die am längsten
+    nicht genutzten Einträge gelöscht, bis die Größe wieder unter max_bytes liegt.
+    """
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.fingerprint = _script_fingerprint()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def key(self, *parts):
+        digest = hashlib.sha256(self.fingerprint.encode('ascii'))
+        for part in parts:
+            digest.update(b'\0')
+            digest.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.folder, key[:2], key)
+
+    def get(self, key):
+        """Liefert die gespeicherten Bytes oder None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        os.utime(path)                                                      # LRU: zuletzt benutzt
+        self.hits += 1
+        return data
+
+    def get_path(self, key):
+        """Wie get(), liefert aber nur den Pfad der Cache-Datei (zum direkten Kopieren)."""
+        path = self._path(key)
+        try:
+            os.utime(path)                                                  # LRU: zuletzt benutzt
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
 
-    # Preface nur prüfen, wenn es nicht auf "none" steht
-    preface_file = config.get('preface', 'none')
-    if preface_file.lower() != "none":
-        preface_path = os.path.join(BASE_DIR, preface_file)
-        if not os.path.exists(preface_path):
-            missing_items.append(f"Preface-Datei: {preface_path}")
+    def put(self, key, data):
+        """Speichert die Bytes und liefert den Pfad der Cache-Datei."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)                                          # atomar, auch bei parallelen Builds
+        return path
 
-    # 3. Das Cover-Bild im Bilder-Ordner prüfen (Der Fix)
-    cover_filename = config.get('cover_image')
-    # Wir kombinieren BASE_DIR + Bilder-Ordner + Dateiname
-    cover_path = os.path.join(BASE_DIR, folder_bilder, cover_filename)
+    def get_json(self, key):
+        data = self.get(key)
+        return None if data is None else json.loads(data.decode('utf-8'))
+
+    def put_json(self, key, value):
+        self.put(key, json.dumps(value, ensure_ascii=False).encode('utf-8'))
+
+    def evict(self):
+        """Löscht die ältesten Einträge, bis die Cache-Größe unter max_bytes liegt."""
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed, total
+
+    def report(self):
+        removed, total = self.evict()
+        print(f"Cache: {self.hits} Treffer, {self.misses} neu berechnet, "
+              f"{total / 1024 / 1024:.1f} MB belegt, {removed} alte Einträge entfernt.")
+
+
+def open_cache(config_dict, base_dir):
+    """Liefert den BuildCache laut JSON oder None, wenn cache_folder auf "none" steht."""
+    folder = str(config_dict.get("cache_folder", ".epub_cache"))
+    if folder.lower() == "none":
+        return None
+    return BuildCache(os.path.join(base_dir, folder), int(config_dict.get("cache_max_mb", 500)) * 1024 * 1024)
+
+
+# ------------------------------------------------------------------------------------------
+# Profiling: Zeit, CPU, I/O und Speicher je Build-Phase
+# ------------------------------------------------------------------------------------------
+def _io_counters():
+    """Bisher gelesene und geschriebene Bytes des Prozesses oder (None, None)."""
+    try:
+        with open('/proc/self/io', 'r') as f:                              # Linux
+            values = dict(line.split(':', 1) for line in f.read().splitlines() if ':' in line)
+        return int(values['rchar']), int(values['wchar'])
+    except (OSError, KeyError, ValueError):
+        pass
+    if module_available('psutil'):                                          # Windows/macOS, falls installiert
+        import psutil
+        try:
+            counters = psutil.Process().io_counters()
+            return counters.read_bytes, counters.write_bytes
+        except (AttributeError, psutil.Error):
+            pass
+    return None, None
+
+
+class BuildProfiler:
+    """Sammelt je Phase Wall- und CPU-Zeit, gelesene/geschriebene Bytes und den Speicher-Peak.
+
+    step(name) beendet die laufende Hauptphase und startet die nächste, phase(name) misst
+    einen Abschnitt innerhalb davon (z.B. das Parsen im Kapitel-Loop). Gleichnamige Phasen
+    werden aufsummiert. Ein abgeschalteter Profiler (NO_PROFILER) misst nichts.
+    Der Speicher-Peak stammt aus tracemalloc und wird nur mit trace_memory=True erfasst.
+    """
+    def __init__(self, enabled=True, trace_memory=False):
+        self.enabled = enabled
+        self.trace_memory = trace_memory and enabled
+        self.phases = {}                                                    # Name -> Summen (Reihenfolge des ersten Starts)
+        self.chapters = []
+        self._stack = []
+        self._step_open = False
+        self._own_tracing = False
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._own_tracing = True
+        self._total = self._snapshot() if enabled else None
+
+    def _snapshot(self):
+        read, written = _io_counters()
+        return {'wall': time.perf_counter(), 'cpu': time.process_time(), 'read': read, 'written': written,
+                'peak': 0}
+
+    def _current_peak(self):
+        """Peak seit dem letzten reset_peak() und Übergabe an alle offenen Phasen."""
+        peak = tracemalloc.get_traced_memory()[1]
+        for frame in self._stack:
+            frame['peak'] = max(frame['peak'], peak)
+        self._total['peak'] = max(self._total['peak'], peak)
+        return peak
+
+    def _enter(self, name):
+        if self.trace_memory:
+            self._current_peak()
+            tracemalloc.reset_peak()
+        self.phases.setdefault(name, {'depth': len(self._stack), 'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+                                      'read_bytes': None, 'written_bytes': None, 'peak_mb': None})
+        frame = self._snapshot()
+        frame['name'] = name
+        self._stack.append(frame)
+
+    def _exit(self):
+        if self.trace_memory:
+            self._current_peak()
+        frame = self._stack.pop()
+        end = self._snapshot()
+        stats = self.phases[frame['name']]
+        stats['calls'] += 1
+        stats['wall_s'] += end['wall'] - frame['wall']
+        stats['cpu_s'] += end['cpu'] - frame['cpu']
+        for key in ('read', 'written'):
+            if frame[key] is not None:
+                stats[f'{key}_bytes'] = (stats[f'{key}_bytes'] or 0) + end[key] - frame[key]
+        if self.trace_memory:
+            stats['peak_mb'] = max(stats['peak_mb'] or 0.0, frame['peak'] / 1024 / 1024)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        self._enter(name)
+        try:
+            yield
+        finally:
+            self._exit()
+
+    def step(self, name):
+        """Beendet die laufende Hauptphase und startet name."""
+        if not self.enabled:
+            return
+        if self._step_open:
+            self._exit()
+        self._enter(name)
+        self._step_open = True
+
+    def chapter(self, file_name, result, cached):
+        """Zähler je Kapitel: Knoten, Bilder und Bytes des XHTML."""
+        if not self.enabled:
+            return
+        self.chapters.append({'file': file_name, 'title': result['title'], 'nodes': result['nodes'],
+                              'images': result['images'], 'bytes': len(result['content'].encode('utf-8')),
+                              'parts': len(result['parts'] or [None]), 'cached': cached})
+
+    def finish(self):
+        """Schließt die letzte Hauptphase und liefert alle Messwerte als JSON-fähiges dict."""
+        if self._step_open:
+            self._exit()
+            self._step_open = False
+        end = self._snapshot()
+        if self.trace_memory:
+            self._current_peak()
+        total = {'wall_s': end['wall'] - self._total['wall'], 'cpu_s': end['cpu'] - self._total['cpu'],
+                 'read_bytes': None if end['read'] is None else end['read'] - self._total['read'],
+                 'written_bytes': None if end['written'] is None else end['written'] - self._total['written'],
+                 'peak_mb': self._total['peak'] / 1024 / 1024 if self.trace_memory else None}
+        if self._own_tracing:
+            tracemalloc.stop()
+            self._own_tracing = False
+        return {'total': total,
+                'phases': [{'name': name, **stats} for name, stats in self.phases.items()],
+                'chapters': self.chapters}
+
+
+NO_PROFILER = BuildProfiler(enabled=False)
+
+
+def _format_bytes(value):
+    return "-" if value is None else f"{value / 1024 / 1024:.1f}"
+
+
+def print_profile(profile):
+    """Tabelle der Phasen (Unterphasen eingerückt, Zeiten inklusive) und die größten Kapitel."""
+    print("\n--- Profil ---")
+    print(f"{'Phase':24s} {'Aufrufe':>8s} {'Wall s':>9s} {'CPU s':>9s} {'Lesen MB':>9s} {'Schr. MB':>9s} {'Peak MB':>9s}")
+    for p in profile['phases'] + [{'name': 'gesamt', 'depth': 0, 'calls': 1, **profile['total']}]:
+        name = "  " * p['depth'] + p['name']
+        peak = "-" if p['peak_mb'] is None else f"{p['peak_mb']:.1f}"
+        print(f"{name:24s} {p['calls']:8d} {p['wall_s']:9.3f} {p['cpu_s']:9.3f} "
+              f"{_format_bytes(p['read_bytes']):>9s} {_format_bytes(p['written_bytes']):>9s} {peak:>9s}")
+    largest = sorted(profile['chapters'], key=lambda c: c['bytes'], reverse=True)[:5]
+    if largest:
+        print("Größte Kapitel:")
+        for c in largest:
+            print(f" -> {c['file']}: {c['bytes'] / 1024:.1f} KB, {c['nodes']} Knoten, {c['images']} Bilder"
+                  f"{' (Cache)' if c['cached'] else ''}")
+
+
+def open_profiler(config_dict):
+    """Profiler laut JSON (profile, profile_memory, profile_pstats) oder NO_PROFILER."""
+    pstats_file = config_dict.get("profile_pstats", "")
+    profiler = NO_PROFILER
+    if config_dict.get("profile", False):
+        profiler = BuildProfiler(trace_memory=bool(config_dict.get("profile_memory", False)))
+    cprofile = None
+    if pstats_file:
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+    return profiler, cprofile
+
+
+def finish_profile(profiler, cprofile, config_dict, base_dir, output_epub):
+    """Schreibt das Profil als JSON und optional den cProfile-Dump (pstats)."""
+    if cprofile is not None:
+        cprofile.disable()
+        pstats_file = os.path.join(base_dir, config_dict.get("profile_pstats"))
+        cprofile.dump_stats(pstats_file)
+        print(f"cProfile gespeichert: {pstats_file} (Anzeige: python -m pstats {os.path.basename(pstats_file)})")
+    if not profiler.enabled:
+        return
+    profile = {'output': output_epub, 'created': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S+00:00'),
+               'parser': config_dict.get("parser"), 'streaming': bool(config_dict.get("streaming", False)),
+               **profiler.finish()}
+    print_profile(profile)
+    profile_file = os.path.join(base_dir, config_dict.get("profile_json", "build_profile.json"))
+    with open(profile_file, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, indent=2, ensure_ascii=False)
+    print(f"Profil gespeichert: {profile_file}")
+
+
+# ------------------------------------------------------------------------------------------
+# Streaming EPUB-Writer
+# ------------------------------------------------------------------------------------------
+# Bereits komprimierte Formate werden nur gespeichert (ZIP_STORED), nicht noch einmal deflated
+STORED_MEDIA_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'font/woff', 'font/woff2'}
+COPY_BUFFER_SIZE = 1024 * 1024
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)                                           # frühestes Datum im ZIP-Format
+
+
+def zip_date_time(mtime):
+    """datetime (UTC) -> date_time Tupel für ZipInfo, nicht vor 1980."""
+    return max(ZIP_EPOCH, mtime.astimezone(timezone.utc).timetuple()[:6])
+
+
+def _normalize_zip_info(info, date_time):
+    """Gleiche Metadaten auf jedem System: Zeitstempel, Rechte 644, Unix als Ersteller."""
+    info.date_time = date_time
+    info.create_system = 3
+    info.external_attr = 0o644 << 16
+    return info
+
+
+class StableZipFile(zipfile.ZipFile):
+    """ZipFile, dessen Einträge alle denselben Zeitstempel und dieselben Attribute tragen."""
+    date_time = ZIP_EPOCH
+
+    def writestr(self, zinfo_or_arcname, data, compress_type=None, compresslevel=None):
+        if isinstance(zinfo_or_arcname, zipfile.ZipInfo):
+            info = zinfo_or_arcname
+        else:
+            info = zipfile.ZipInfo(zinfo_or_arcname)
+            info.compress_type = self.compression if compress_type is None else compress_type
+        super().writestr(_normalize_zip_info(info, self.date_time), data, compress_type,
+                         self.compresslevel if compresslevel is None else compresslevel)
+
+
+class StableEpubWriter(epub.EpubWriter):
+    """ebooklib-Writer mit StableZipFile: gleiche Eingabe ergibt byte-gleiche EPUBs."""
+    date_time = ZIP_EPOCH
+
+    def write(self):
+        self.out = StableZipFile(self.file_name, 'w', zipfile.ZIP_DEFLATED,
+                                 compresslevel=self.options["compresslevel"])
+        self.out.date_time = self.date_time
+        self.out.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        self._write_container()
+        self._write_opf()
+        self._write_items()
+        self.out.close()
+
+
+class StreamingEpubWriter(epub.EpubWriter):
+    """Schreibt das EPUB Eintrag für Eintrag.
+
+    OPF, NCX und Navigation erzeugt weiterhin ebooklib. Dateien mit Quellpfad (FileItem)
+    werden blockweise von der Platte ins ZIP kopiert, es liegt also nie das ganze Buch
+    im Speicher. "mimetype" steht wie gefordert als erster, unkomprimierter Eintrag.
+    Ist entry_memo gesetzt (Watch-Modus), erzeugt ebooklib nur geänderte Kapitel neu.
+    """
+    entry_memo = None                                                       # Inhalts-Schlüssel -> fertiges XHTML
+    date_time = None                                                        # fester Zeitstempel (reproduzierbar), sonst jetzt
+
+    def _html_content(self, item, memo):
+        """XHTML eines Kapitels, aus entry_memo wenn Inhalt, Titel und Links gleich geblieben sind."""
+        if self.entry_memo is None:
+            return item.get_content()
+        content = item.content if isinstance(item.content, bytes) else str(item.content).encode('utf-8')
+        head = (item.file_name, item.title, item.lang, self.book.language, item.direction, item.links, item.metas)
+        key = hashlib.sha1(repr(head).encode('utf-8') + content).hexdigest()
+        data = self.entry_memo.get(key)
+        if data is None:
+            data = item.get_content()
+        memo[key] = data
+        return data
+
+    def _zip_info(self, name, media_type=None):
+        info = zipfile.ZipInfo(name)
+        info.compress_type = zipfile.ZIP_STORED if media_type in STORED_MEDIA_TYPES else zipfile.ZIP_DEFLATED
+        return _normalize_zip_info(info, self.date_time or time.localtime(time.time())[:6])
+
+    def _write_entry(self, name, media_type, data=None, source_path=None):
+        info = self._zip_info(name, media_type)
+        if source_path is None:
+            self.out.writestr(info, data, compresslevel=self.options["compresslevel"])
+            return
+        large = os.path.getsize(source_path) > zipfile.ZIP64_LIMIT
+        with open(source_path, 'rb') as src, self.out.open(info, 'w', force_zip64=large) as dst:
+            shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+
+    def _write_container(self):
+        container_xml = epub.CONTAINER_XML % {"folder_name": self.book.FOLDER_NAME}
+        self._write_entry(epub.CONTAINER_PATH, None, container_xml)
+
+    def _write_items(self):
+        folder = self.book.FOLDER_NAME
+        memo = {}
+        for item in self.book.get_items():
+            name = f"{folder}/{item.file_name}" if item.manifest else item.file_name
+            if isinstance(item, epub.EpubNcx):
+                self._write_entry(name, None, self._get_ncx())
+            elif isinstance(item, epub.EpubNav):
+                self._write_entry(name, None, self._get_nav(item))
+            elif isinstance(item, FileItem) and not item.content:
+                self._write_entry(name, item.media_type, source_path=item.source_path)
+            elif isinstance(item, epub.EpubHtml) and not isinstance(item, epub.EpubCoverHtml):
+                self._write_entry(name, item.media_type, self._html_content(item, memo))
+            else:
+                self._write_entry(name, item.media_type, item.get_content())
+        if self.entry_memo is not None:
+            # Nur Kapitel des aktuellen Buchs behalten
+            self.entry_memo.clear()
+            self.entry_memo.update(memo)
+
+    def write(self):
+        self.out = StableZipFile(self.file_name, 'w', zipfile.ZIP_DEFLATED,
+                                 compresslevel=self.options["compresslevel"], allowZip64=True)
+        self.out.date_time = self.date_time or time.localtime(time.time())[:6]  # auch für das OPF von ebooklib
+        self.out.writestr(self._zip_info("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        self._write_container()
+        self._write_opf()                                                   # OPF erzeugt und schreibt ebooklib selbst
+        self._write_items()
+        self.out.close()
+
+
+def _has_page_markers(item):
+    """True, wenn das Dokument epub:type Attribute enthalten könnte (Seitenmarken)."""
+    if isinstance(item, epub.EpubNav):
+        return False
+    content = item.content or b''
+    return (b'epub:type' if isinstance(content, bytes) else 'epub:type') in content
+
+
+def write_book(output_epub, book, writer="ebooklib", entry_memo=None, mtime=None):
+    """Schreibt das Buch mit dem gewählten Writer ("ebooklib" oder "stream").
+
+    Geschrieben wird in eine temporäre Datei, die erst am Ende das alte EPUB ersetzt. Ein
+    E-Reader oder Sync-Programm sieht so nie eine halb geschriebene Datei.
+    mtime (datetime) macht den Build reproduzierbar: feste Zeitstempel in OPF und ZIP, Einträge
+    nach Namen sortiert. Sind die Bytes dann gleich wie im vorhandenen EPUB, bleibt es unangetastet.
+    Rückgabe: True wenn das EPUB neu geschrieben wurde, False wenn es unverändert ist, None bei Fehler.
+    """
+    tmp_epub = f"{output_epub}.{os.getpid()}.tmp"
+    # Die Seitenliste (page-list) parst jedes Kapitel erneut; ohne epub:type Marker bleibt sie ohnehin leer
+    options = {'epub3_pages': any(_has_page_markers(item) for item in book.get_items_of_type(ebooklib.ITEM_DOCUMENT))}
+    date_time = None
+    if mtime is not None:
+        options['mtime'] = mtime.astimezone(timezone.utc)                   # dcterms:modified
+        date_time = zip_date_time(mtime)
+        book.items.sort(key=lambda item: _natural_key(item.file_name))
+    try:
+        if str(writer).lower() == "stream":
+            epub_writer = StreamingEpubWriter(tmp_epub, book, options)
+            epub_writer.entry_memo = entry_memo
+            epub_writer.date_time = date_time
+            epub_writer.process()
+            epub_writer.write()
+        elif date_time is not None:
+            epub_writer = StableEpubWriter(tmp_epub, book, options)
+            epub_writer.date_time = date_time
+            epub_writer.process()
+            epub_writer.write()
+        elif not epub.write_epub(tmp_epub, book, options):                  # ebooklib meldet Schreibfehler nur so
+            print(f"FEHLER: {output_epub} konnte nicht geschrieben werden.")
+            return None
+        if mtime is not None and os.path.exists(output_epub) and filecmp.cmp(tmp_epub, output_epub, shallow=False):
+            print(f"Info: {output_epub} ist unverändert (gleiche Bytes), die Datei bleibt unangetastet.")
+            return False
+        os.replace(tmp_epub, output_epub)
+        return True
+    finally:
+        if os.path.exists(tmp_epub):
+            os.remove(tmp_epub)
+
+
+# ------------------------------------------------------------------------------------------
+# Kapitel und CSS rendern (Ergebnisse sind JSON-fähig und damit cachebar)
+# ------------------------------------------------------------------------------------------
+def _add_image(registry, local_img, folder_bilder=None):
+    """Fügt ein Bild einmalig ins Buch ein und liefert das EpubItem.
+
+    Liegt im Bilder-Ordner eine andere Datei gleichen Namens, bleibt ihr Name frei; das Bild wird
+    als Namenskollision gemeldet und unter eigenem Namen gespeichert (x_2.jpg).
+    """
+    img_item = registry.get(local_img)
+    if img_item is None:
+        f_name = os.path.basename(local_img)
+        if folder_bilder:
+            registry.reserve(os.path.join(folder_bilder, f_name))
+        img_item = registry.add_file(local_img, 'img', get_image_mime(f_name))
+        print(f"Bild hinzugefügt: {f_name}")
+    return img_item
+
+
+SPLIT_HEADINGS = ('h1', 'h2', 'h3')
+PART_HREF = "__teil{}__.xhtml"                                              # Platzhalter, create_epub setzt chap_{i}_{k}.xhtml ein
+PART_HREF_RE = re.compile(r'__teil(\d+)__\.xhtml')
+TOC_HEADINGS = ('h2', 'h3')                                                 # Unterpunkte im Inhaltsverzeichnis (chapter_toc)
+FRAGMENT_HREF = re.compile(r'href="#([^"]+)"')
+
+
+def _all_tags(nodes):
+    """Alle Tags der Knoten, die Knoten selbst eingeschlossen."""
+    for node in nodes:
+        if isinstance(node, Tag):
+            yield node
+            yield from node.find_all(True)
+
+
+def collect_anchors(nodes):
+    """Alle Sprungziele (id, <a name>) in den Knoten."""
+    return [anchor for tag in _all_tags(nodes)
+            for anchor in (tag.get('id'), tag.get('name') if tag.name == 'a' else None) if anchor]
+
+
+def collect_headings(nodes):
+    """h2/h3 Überschriften mit id als [Ebene, id, Text] (für chapter_toc)."""
+    return [[int(tag.name[1]), tag['id'], tag.get_text(strip=True)[:80]] for tag in _all_tags(nodes)
+            if tag.name in TOC_HEADINGS and tag.get('id') and tag.get_text(strip=True)]
+
+
+def _shows_content(node):
+    """True für Knoten, die auf der Seite etwas zeigen (nicht <break>, Kommentar oder Leerraum)."""
+    if isinstance(node, Comment):
+        return False
+    if isinstance(node, Tag):
+        return node.name != 'break'
+    return bool(str(node).strip())
+
+
+def split_chapter(chap_soup, max_bytes=0, max_nodes=0):
+    """Teilt ein zu großes Kapitel in Teile von höchstens max_bytes bzw. max_nodes.
+
+    Geschnitten wird vor der letzten h1-h3 Überschrift des laufenden Teils, ohne Überschrift an
+    der nächsten Blockgrenze (Top-Level Knoten). Ein einzelner Knoten über dem Limit bleibt ein
+    eigener Teil. Jeder Teil zeigt Inhalt: vor der ersten Überschrift mit nur <break>, Kommentaren
+    oder Leerraum davor wird nicht geschnitten. Links auf Anker in einem anderen Teil zeigen danach
+    auf PART_HREF.
+    Rückgabe: [[Titel oder None, XHTML, Anker, Überschriften], ...]
+    """
+    groups = []
+    current = []                                                            # (Knoten, Bytes, Elemente)
+    size = count = 0                                                        # Summen über current
+    heading = 0                                                             # Index der letzten Überschrift in current
+    filled = False                                                          # zeigt current schon Inhalt?
+    for node in detach_children(chap_soup.body):
+        is_tag = isinstance(node, Tag)
+        entry = (node, len(str(node).encode('utf-8')), 1 + len(node.find_all(True)) if is_tag else 0)
+        if filled and ((max_bytes and size + entry[1] > max_bytes) or (max_nodes and count + entry[2] > max_nodes)):
+            cut = heading or len(current)
+            groups.append(current[:cut])
+            current = current[cut:]
+            size = sum(e[1] for e in current)
+            count = sum(e[2] for e in current)
+            heading = 0
+            filled = any(_shows_content(e[0]) for e in current)
+        if is_tag and node.name in SPLIT_HEADINGS and filled:
+            heading = len(current)
+        current.append(entry)
+        size += entry[1]
+        count += entry[2]
+        filled = filled or _shows_content(node)
+    if current:
+        if filled or not groups:
+            groups.append(current)
+        else:
+            groups[-1].extend(current)                                      # nur Leerraum/Kommentare am Ende
+
+    parts = [[node for node, _, _ in group] for group in groups]
+    # Welcher Anker liegt in welchem Teil?
+    part_anchors = [collect_anchors(nodes) for nodes in parts]
+    anchors = {}
+    for k, names in enumerate(part_anchors):
+        for anchor in names:
+            anchors.setdefault(anchor, k)
+    result = []
+    for k, nodes in enumerate(parts):
+        title = None
+        for node in nodes:
+            if isinstance(node, Tag):
+                if title is None and node.name in SPLIT_HEADINGS:
+                    title = node.get_text(strip=True)[:80]
+                for a_link in node.find_all('a', href=True) + ([node] if node.name == 'a' and node.get('href') else []):
+                    target = anchors.get(a_link['href'][1:]) if a_link['href'].startswith('#') else None
+                    if target is not None and target != k:
+                        a_link['href'] = PART_HREF.format(target) + a_link['href']
+        result.append([title, assemble_chapter(nodes).encode(formatter="html").decode('utf-8'),
+                       part_anchors[k], collect_headings(nodes)])
+    return result
+
+
+def render_chapter(section, base_dir, folder_bilder, registry, css_pruner=None, snapshots=None,
+                   max_bytes=0, max_nodes=0, heading_ids=False):
+    """Baut aus den Knoten einer Sektion das Kapitel-XHTML.
+
+    Rückgabe: {'empty', 'title', 'valuable', 'content', 'parts', 'anchors', 'headings', 'resources',
+    'missing', 'chars', 'nodes', 'images'}. Ist das Kapitel größer als max_bytes/max_nodes, enthält
+    parts die Teile aus split_chapter(), sonst None. anchors sind alle ids des Kapitels (Link-Index),
+    headings die h2/h3 mit id; heading_ids=True vergibt fehlende ids an diese Überschriften.
+    resources enthält je Bild [src im HTML, lokaler Pfad, Dateiname im EPUB], damit ein Cache-Treffer
+    die Bilder wieder in der Registry anmelden kann; missing die lokalen Bilder, die es (noch) nicht
+    gibt. chars sind alle Zeichen des Kapitels (Font-Subsetting), nodes und images zählen Elemente
+    und <img> Tags (Profiling). snapshots: gerenderte iframe-Bilder aus render_iframes().
+    """
+    title = None
+    for item in section:
+        if isinstance(item, Tag) and item.name in ['h1', 'h2']:
+            title = item.get_text(strip=True)[:80]
+            break
     
-    if not os.path.exists(cover_path):
-        missing_items.append(f"Cover-Bild (im Bilder-Ordner): {cover_path}")
+    # HTML Dokument (flache Struktur: CSS ist einfach "hans.css")
+    chap_soup = assemble_chapter(section)
     
-    if missing_items:
-        print("\n" + "!"*60)
-        print("KRITISCHE RESSOURCEN FEHLEN:")
-        for item in missing_items:
-            print(f" -> {item}")
-        print("!"*60 + "\n")
+    valuable = False
+    resources = []
+    missing = []
+    for node in section:
+        if isinstance(node, Tag):
+            # Bilder-Pfade auf flache Ebene korrigieren
+            # 1. Alle Bilder (img-Tags) korrigieren, auch ein Top-Level <img> (z.B. aus einem iframe)
+            for img in [tag for tag in _all_tags([node]) if tag.name == 'img']:
+                old_src = img.get('src', '')
+                
+                # Pfad zur lokalen Datei auf deinem PC prüfen
+                local_img = resolve_local_image(old_src, base_dir, folder_bilder, snapshots, registry.manifest)
+                if local_img:
+                    # Bild nur hinzufügen, wenn es noch nicht im Buch ist
+                    img_item = _add_image(registry, local_img, folder_bilder)
+                    resources.append([old_src, local_img, img_item.file_name])
+                    
+                    # WICHTIG: Die Quelle im HTML auf den lokalen Namen setzen
+                    img['src'] = img_item.file_name
+                elif old_src and not old_src.startswith(('data:', 'http:', 'https:')):
+                    # z.B. ein iframe ohne TAGxx.jpg: sonst fehlt das Bild im Buch kommentarlos
+                    missing.append(old_src)
+                    print(f"HINWEIS: Bild nicht gefunden: {old_src}")
         
-        # Abbruch-Bedingung
-        html_path = os.path.join(BASE_DIR, config.get('source_html'))
-        if not os.path.exists(html_path):
-            print("Abbruch: Quell-HTML fehlt.")
-            sys.exit(1)
+            # Alle "Zurück zum Index" Links im Kapitel finden (auch wenn der Link selbst ein Top-Level Knoten ist)
+            for a_link in _all_tags([node]):
+                if a_link.name == 'a' and a_link.get('href') == "#index":
+                    # Link zum generierten Inhaltsverzeichnis des EPUBs umleiten
+                    a_link['href'] = "nav.xhtml"
 
+                    # Falls ein Button-Tag darin ist, entfernen wir es und behalten nur den Text
+                    btn = a_link.find('button')
+                    if btn:
+                        # Wir geben dem Link eine Klasse für das CSS-Styling
+                        # a_link['class'] = a_link.get('class', []) + ['btn-back']
+                        a_link['class'] = a_link.get('class', []) + ['button']
+                        a_link.string = btn.get_text() # Setzt "Zurück zum Index" als Text
 
+            # 2. Falls Bilder in Links (a-Tags) eingebettet sind (Lightbox-Stil)
+            for a_link in [tag for tag in _all_tags([node]) if tag.name == 'a']:
+                link_href = a_link.get('href', '')
+                # Prüfen, ob der Link auf ein Bild verweist
+                if link_href.lower().endswith(tuple(IMAGE_MIME)):
+                    a_name = os.path.basename(link_href)
+                    # Verlinktes Bild ebenfalls ins Buch übernehmen, sonst läuft der Link ins Leere
+                    local_img = resolve_local_image(link_href, base_dir, folder_bilder, snapshots, registry.manifest)
+                    if local_img:
+                        a_name = _add_image(registry, local_img, folder_bilder).file_name
+                        resources.append([link_href, local_img, a_name])
+                    # Link im Buch auf die lokale Datei umbiegen
+                    a_link['href'] = a_name
 
-def get_font_mime(filename):
-    ext = os.path.splitext(filename)[1].lower()
-    mapping = {'.ttf': 'font/ttf', '.otf': 'font/otf', '.woff': 'font/woff', '.woff2': 'font/woff2'}
-    return mapping.get(ext, 'application/vnd.ms-opentype')
+            if node.get_text(strip=True) or node.name == 'img' or node.find('img'):
+                valuable = True
+
+    anchors = collect_anchors(section)
+    if heading_ids:
+        # Überschriften ohne id bekommen eine, damit das Inhaltsverzeichnis sie anspringen kann
+        taken = set(anchors)
+        n = 0
+        for tag in _all_tags(section):
+            if tag.name in TOC_HEADINGS and not tag.get('id'):
+                n += 1
+                while f"abschnitt-{n}" in taken: n += 1
+                tag['id'] = f"abschnitt-{n}"
+                anchors.append(tag['id'])
+
+    if valuable and css_pruner is not None:
+        css_pruner.scan(chap_soup)
+    content = chap_soup.encode(formatter="html").decode('utf-8') if valuable else None
+    chars = "".join(sorted(set(chap_soup.body.get_text()))) if valuable else ""
+    node_count = len(chap_soup.body.find_all(True))
+    image_count = len(chap_soup.body.find_all('img'))
+    parts = None
+    if valuable and ((max_bytes and len(content.encode('utf-8')) > max_bytes) or (max_nodes and node_count > max_nodes)):
+        parts = split_chapter(chap_soup, max_bytes, max_nodes)
+        if len(parts) < 2:
+            parts = None                                                    # ein einzelner Block lässt sich nicht teilen
+    return {'empty': not section, 'title': title, 'valuable': valuable, 'content': content, 'parts': parts,
+            'anchors': anchors, 'headings': collect_headings(section), 'resources': resources, 'missing': missing, 'chars': chars,
+            'nodes': node_count, 'images': image_count}
+
+
+def restore_resources(result, base_dir, folder_bilder, registry, snapshots=None):
+    """Meldet die Bilder eines gecachten Kapitels wieder an.
+
+    Liefert False, wenn sich Auflösung oder Dateiname geändert haben oder ein fehlendes Bild
+    inzwischen vorhanden ist - dann ist der Cache-Eintrag nicht mehr passend und das Kapitel
+    wird neu gebaut.
+    """
+    if any(resolve_local_image(src, base_dir, folder_bilder, snapshots, registry.manifest) for src in result['missing']):
+        return False
+    for src, local_img, file_name in result['resources']:
+        if resolve_local_image(src, base_dir, folder_bilder, snapshots, registry.manifest) != local_img:
+            return False
+        if _add_image(registry, local_img, folder_bilder).file_name != file_name:
+            return False
+    for src in result['missing']:
+        print(f"HINWEIS: Bild nicht gefunden: {src}")
+    return True
+
+
+def rewrite_fragment_links(documents):
+    """Leitet Links auf Anker in anderen Dateien um (Kapitel, Teile, Vorwort).
+
+    documents: [(EpubHtml, Anker), ...] in Buchreihenfolge. Erst entsteht der Index id -> Datei
+    (doppelte ids: die erste Datei gewinnt), dann ersetzt ein Durchlauf je Datei jedes href="#id",
+    dessen Ziel nicht in der Datei selbst liegt, durch href="Datei#id".
+    Rückgabe: [(Datei, id), ...] für Links, deren Anker es im ganzen Buch nicht gibt.
+    """
+    index = {}
+    for item, anchors in documents:
+        for anchor in anchors:
+            index.setdefault(anchor, item.file_name)
+    dangling = []
+    for item, anchors in documents:
+        if 'href="#' not in item.content: continue
+        own = set(anchors)
+
+        def replace(match):
+            anchor = match.group(1)
+            if anchor in own:
+                return match.group(0)
+            if anchor not in index:
+                dangling.append((item.file_name, anchor))
+                return match.group(0)
+            return f'href="{index[anchor]}#{anchor}"'
+
+        item.content = FRAGMENT_HREF.sub(replace, item.content)
+    return dangling
+
+
+def rewrite_css(css_content, folder_fonts, registry):
+    """Stellt die Fonts aus dem CSS bereit und biegt die url() auf die flache Struktur um.
+
+    Rückgabe: {'css', 'fonts', 'missing'} mit fonts = [[lokaler Pfad, Dateiname im EPUB]] und
+    missing = lokale Pfade der url(), die es (noch) nicht gibt - taucht einer davon auf, ist ein
+    Cache-Eintrag nicht mehr passend.
+    """
+    fonts = []
+    missing = []
+    font_urls = re.findall(r'url\([\'"]?([^)\'"]+)[\'"]?\)', css_content)
+    for full_url in dict.fromkeys(font_urls):                               # Reihenfolge wie im CSS (reproduzierbar)
+        clean_path = full_url.split('?')[0].split('#')[0]
+        f_name = os.path.basename(clean_path)
+        local_font = os.path.join(folder_fonts, f_name)
+        
+        if registry.manifest.isfile(local_font):
+            # Fonts liegen jetzt im selben "Verzeichnis" wie das CSS
+            font_item = registry.add_file(local_font, 'font', get_font_mime(f_name))
+            fonts.append([local_font, font_item.file_name])
+            # In der flachen Struktur ist der Pfad einfach der Dateiname
+            css_content = css_content.replace(full_url, font_item.file_name)
+            print(f"Font bereitgestellt: {font_item.file_name}")
+        else:
+            missing.append(local_font)
+    return {'css': css_content, 'fonts': fonts, 'missing': missing}
 
 
-def create_epub():
+REPRODUCIBLE_DATE = datetime(*ZIP_EPOCH, tzinfo=timezone.utc)                # reproduzierbar ohne build_date: 1980-01-01
+
+
+def build_timestamp(config_dict):
+    """Zeitpunkt des Builds (UTC) und ob reproduzierbar gebaut wird.
+
+    Reproduzierbar (config "reproducible" oder Umgebungsvariable SOURCE_DATE_EPOCH gesetzt) gilt
+    SOURCE_DATE_EPOCH, sonst "build_date" aus der JSON, sonst das feste REPRODUCIBLE_DATE. Das
+    Datum hängt nicht an Dateien: touch oder Checkout ändern das EPUB nicht, neue Inhalte schon.
+    """
+    epoch = os.environ.get("SOURCE_DATE_EPOCH", "").strip()
+    if epoch:
+        try:
+            return datetime.fromtimestamp(int(epoch), timezone.utc), True
+        except ValueError:
+            print(f"FEHLER: SOURCE_DATE_EPOCH '{epoch}' ist keine Zahl. Wird ignoriert.")
+    if not config_dict.get("reproducible", False):
+        return datetime.now(timezone.utc), False
+    build_date = str(config_dict.get("build_date", "")).strip()
+    if build_date:
+        try:
+            stamp = datetime.fromisoformat(build_date)
+            return (stamp if stamp.tzinfo else stamp.replace(tzinfo=timezone.utc)).astimezone(timezone.utc), True
+        except ValueError:
+            print(f"FEHLER: build_date '{build_date}' ist kein ISO-Datum (z.B. 2026-01-02). Wird ignoriert.")
+    print(f"HINWEIS: Kein build_date gesetzt. Das Buch bekommt das feste Datum {REPRODUCIBLE_DATE.date()} "
+          "- Reader zeigen es als Erscheinungsdatum. build_date in der JSON setzen.")
+    return REPRODUCIBLE_DATE, True
+
+
+def create_epub(json_file_name=None, base_dir=None, overrides=None, session=None):
+    """Baut ein Buch. Alle Pfade der JSON gelten relativ zu base_dir.
+
+    json_file_name=None nutzt die JSON neben dem Skript, base_dir=None den Ordner der JSON
+    (bzw. des Skripts). overrides ersetzt einzelne config-Werte nur für diesen Lauf.
+    session (WatchSession) hält im Watch-Modus Cache und Zwischenstände zwischen den Builds.
+    Rückgabe: {'output', 'chapters', 'changed'} oder None, wenn kein Kapitel gefunden wurde.
+    changed ist False, wenn ein reproduzierbarer Build byte-gleich zum vorhandenen EPUB war.
+    """
     # 1. JSON laden (mit Auto-Repair Logik)
-    translate_table = load_json(None)               # Lade in deine eigene Translation Tabelle
-    config_dict = translate_table.get("config")
+    translate_table = load_json(json_file_name)     # Lade in deine eigene Translation Tabelle
+    config_dict = {**translate_table.get("config"), **(overrides or {})}    # overrides nur für diesen Lauf
+    if base_dir is None:
+        base_dir = os.path.dirname(os.path.abspath(json_file_name)) if json_file_name else BASE_DIR
+
+    # Profiling (nur wenn in der JSON eingeschaltet): jede Phase wird einzeln gemessen
+    profiler, cprofile = open_profiler(config_dict)
+    profiler.step('setup')
     
-    # 2. Alle Ressourcen prüfen (HIER NEU)
-    check_resources(config_dict)
+    # 2. Alle Ressourcen prüfen (HIER NEU), Bilder- und Font-Ordner werden dafür einmal gescannt
+    manifest = open_manifest(config_dict, base_dir)
+    check_resources(config_dict, base_dir, manifest)
     
     # 3. Pfade setzen
-    SOURCE_HTML = os.path.join(BASE_DIR, config_dict.get("source_html"))
-    SOURCE_CSS = os.path.join(BASE_DIR, config_dict.get("source_css"))
-    FOLDER_FONTS = os.path.join(BASE_DIR, config_dict.get("folder_fonts"))
-    FOLDER_BILDER = os.path.join(BASE_DIR, config_dict.get("folder_bilder"))
-    OUTPUT_EPUB = config_dict.get("output_epub")
+    SOURCE_FILES = resolve_sources(config_dict.get("source_html"), base_dir)
+    SOURCE_CSS = os.path.join(base_dir, config_dict.get("source_css"))
+    FOLDER_FONTS = os.path.join(base_dir, config_dict.get("folder_fonts"))
+    FOLDER_BILDER = os.path.join(base_dir, config_dict.get("folder_bilder"))
+    OUTPUT_EPUB = os.path.join(base_dir, config_dict.get("output_epub"))
 
     print("--- Starte EPUB-Generierung ---")
-    print(f"Verwende Quell-HTML: {SOURCE_HTML}")
-    # Erzeugt automatisch: 2025-12-31T18:36:00+00:00 (Beispiel)
-    current_time = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+    print(f"Verwende Quell-HTML: {SOURCE_FILES[0] if len(SOURCE_FILES) == 1 else f'{len(SOURCE_FILES)} Dateien'}")
+    # Erzeugt automatisch: 2025-12-31T18:36:00+00:00 (Beispiel), reproduzierbar ein festes Datum
+    build_time, reproducible = build_timestamp(config_dict)
+    current_time = build_time.strftime('%Y-%m-%dT%H:%M:%S+00:00')
     
     # 3. ePub Metadata setzen
     book = epub.EpubBook()
     metadata_dict = translate_table.get("metadata") # get from json
+    if reproducible:
+        # Stabile Buch-ID aus den Metadaten statt einer zufälligen UUID je Lauf
+        book.set_identifier(str(uuid.uuid5(uuid.NAMESPACE_URL, "|".join(
+            str(metadata_dict.get(key)) for key in ("title", "author", "language")))))
+        print(f"Reproduzierbarer Build: Datum {current_time}, ID {book.uid}")
     book.set_title(metadata_dict.get("title"))
     book.add_author(metadata_dict.get("author"))
     book.set_language(metadata_dict.get("language"))
@@ -196,85 +2410,78 @@ def create_epub():
    
     # --- COVER DEFINIEREN ---
     # Pfad zu deinem Cover-Bild (muss im Ordner 'bilder' liegen)
+    # Die Registry kennt ab jetzt jede Datei im Buch (feste Namen sind reserviert)
+    preface_config = config_dict.get("preface", "none")
+    registry = ResourceRegistry(book, reserved_names=['hans.css', 'nav.xhtml', 'toc.ncx', 'cover.xhtml', preface_config],
+                                profiler=profiler, digest_memo=session.digests if session else None,
+                                manifest=manifest)
     cover_path = os.path.join(FOLDER_BILDER, config_dict.get("cover_image")) 
-    if os.path.exists(cover_path):
-        # set_cover macht zwei Dinge: Bild hinzufügen und als Cover markieren
-        book.set_cover(config_dict.get("cover_image"), open(cover_path, 'rb').read())
+    if manifest.isfile(cover_path):
+        registry.add_cover(cover_path, config_dict.get("cover_image"))
         print("Cover-Bild wurde hinzugefügt.")
     else:
         print("HINWEIS: cover.jpg wurde im Bilder-Ordner nicht gefunden.")
 
+    # Build-Cache (content-adressiert, "none" schaltet ihn ab)
+    cache = session.cache if session else open_cache(config_dict, base_dir)
+
     # 1. CSS & FONTS (Pfade für flache Struktur anpassen)
+    profiler.step('css')
     css_content = ""
     if os.path.exists(SOURCE_CSS):
         with open(SOURCE_CSS, 'r', encoding='utf-8') as f:
             css_content = f.read()
         
-        font_urls = re.findall(r'url\([\'"]?([^)\'"]+)[\'"]?\)', css_content)
-        for full_url in set(font_urls):
-            clean_path = full_url.split('?')[0].split('#')[0]
-            f_name = os.path.basename(clean_path)
-            local_font = os.path.join(FOLDER_FONTS, f_name)
-            
-            if os.path.exists(local_font):
-                uid = f"font_{f_name.replace('.', '_')}"
-                with open(local_font, 'rb') as ff:
-                    # Fonts liegen jetzt im selben "Verzeichnis" wie das CSS
-                    font_item = epub.EpubItem(uid=uid, file_name=f_name, 
-                                             media_type=get_font_mime(f_name), content=ff.read())
-                    book.add_item(font_item)
-                # In der flachen Struktur ist der Pfad einfach der Dateiname
-                css_content = css_content.replace(full_url, f_name)
-                print(f"Font bereitgestellt: {f_name}")
+        css_key = cache.key('css', css_content, FOLDER_FONTS) if cache else None
+        css_result = cache.get_json(css_key) if cache else None
+        if css_result is not None and any(manifest.isfile(path) for path in css_result['missing']):
+            css_result = None                                               # ein fehlender Font ist inzwischen da
+        if css_result is not None:
+            for local_font, file_name in css_result['fonts']:
+                f_name = os.path.basename(local_font)
+                if not manifest.isfile(local_font) or \
+                   registry.add_file(local_font, 'font', get_font_mime(f_name)).file_name != file_name:
+                    css_result = None
+                    break
+        if css_result is None:
+            css_result = rewrite_css(css_content, FOLDER_FONTS, registry)
+            if cache: cache.put_json(css_key, css_result)
+        css_content = css_result['css']
+
+    # CSS-Pruning: die Kapitel melden beim Rendern, welche Selektoren greifen
+    css_pruner = None
+    if config_dict.get("css_prune", False) and css_content:
+        css_pruner = CssPruner(css_content, int(config_dict.get("css_prune_min_width", 1024)))
 
     # CSS Datei erstellen (flache Ebene)
     style_item = epub.EpubItem(uid="style_hans", file_name="hans.css", media_type="text/css", content=css_content)
     book.add_item(style_item)
 
-    # 2. HTML LADEN
-    with open(SOURCE_HTML, 'r', encoding='utf-8') as f:
-        soup = BeautifulSoup(f, 'html.parser')
-
-    # Erst die unerwünschten Sektionen löschen
-    for hide_tag in soup.find_all('hide'):
-        hide_tag.decompose()
-
-    # --- IFRAME ZU BILD WANDELN (START) ---
-    for iframe in soup.find_all('iframe'):
-        src = iframe.get('src', '')
-        if src:
-            # Extrahiert den Dateinamen (z.B. TAG05.html)
-            file_name_ext = os.path.basename(src)
-            if file_name_ext.lower().endswith('.html'):
-                # Ersetzt .html durch .jpg (z.B. TAG05.jpg)
-                new_img_name = os.path.splitext(file_name_ext)[0] + '.jpg'
-                
-                # Erstellt ein neues img-Tag
-                new_img = soup.new_tag('img', src=new_img_name)
-                
-                # Kopiert vorhandene Attribute (optional, falls width/height bleiben sollen)
-                if iframe.get('width'): new_img['width'] = iframe['width']
-                
-                # Ersetzt das iframe durch das neue img
-                iframe.replace_with(new_img)
-    # --- IFRAME ZU BILD WANDELN (ENDE) ---
-
-    body = soup.find('body')
+    # 2. HTML LADEN (Parser-Backend aus der JSON, Standard: schnellstes installiertes)
+    parser = resolve_parser(config_dict.get("parser", "auto"))
+    streaming = bool(config_dict.get("streaming", False))
+    print(f"Parser: {parser}{' (Streaming)' if streaming else ''}")
+    # Alle Zeichen im Buch (für das Font-Subsetting)
+    used_chars = set()
 
     # --- PREFACE EINBINDEN (STEUERUNG ÜBER JSON) ---
-    preface_config = config_dict.get("preface", "none")
+    profiler.step('preface')
     print(preface_config)
     preface_item = None
+    preface_anchors = []
     if preface_config.lower() != "none":
-        preface_path = os.path.join(BASE_DIR, preface_config)
+        preface_path = os.path.join(base_dir, preface_config)
         print(preface_path)
         
         if os.path.exists(preface_path):
             with open(preface_path, 'r', encoding='utf-8') as f:
                 preface_raw = f.read()
             
-            p_soup = BeautifulSoup(preface_raw, 'html.parser')
+            p_soup = parse_html(preface_raw, parser)
+            used_chars.update(p_soup.get_text())
+            if css_pruner: css_pruner.scan(p_soup)
             p_content = "".join([str(c) for c in p_soup.body.contents]) if p_soup.body else preface_raw
+            preface_anchors = collect_anchors(p_soup.body.contents) if p_soup.body else []
 
             # Wir nutzen den Dateinamen aus der Config auch als internen Namen im EPUB
             preface_item = epub.EpubHtml(title='Vorwort', file_name=preface_config, lang='de')
@@ -289,93 +2496,73 @@ def create_epub():
         print("Info: Kein Vorwort (preface: none) konfiguriert.")
     # --- PREFACE EINBINDEN (ENDE) ---
 
-    # 3. KAPITEL-SPLITTING
-    sections = []
-    current_section = []
-    for element in body.contents:
-        if isinstance(element, Comment): continue
-        if isinstance(element, Tag) and element.name in ['hr']: continue        # Werfe die HR Elemente raus die du so dringend in der Webseite benötigst.
-        # if isinstance(element, Tag) and element.name in ['h1', 'h2']:         # Alternative Kapiteltrenner, 31.12.2025 außer Betrieb gesetzt. lässt sich mit break besser steuern.
-        if isinstance(element, Tag) and element.name in ['break']:
-            if current_section: sections.append(current_section)
-            current_section = [element]
-        else:
-            current_section.append(element)
-    if current_section: sections.append(current_section)
+    # iframe-Seiten ohne fertiges TAGxx.jpg als Bild rendern (nur wenn in der JSON konfiguriert)
+    profiler.step('iframes')
+    snapshots = render_iframes([(os.path.dirname(path), src) for path in SOURCE_FILES if os.path.exists(path)
+                                for src in find_iframe_sources(path)], FOLDER_BILDER, config_dict, cache, manifest) \
+        if str(config_dict.get("iframe_render", "none")).lower() != "none" else {}
 
-    chapters = []
-    for i, section in enumerate(sections):
-        title = f"Kapitel {i+1}"
-        for item in section:
-            if isinstance(item, Tag) and item.name in ['h1', 'h2']:
-                title = item.get_text(strip=True)[:80]
-                break
-        
-        # HTML Dokument (flache Struktur: CSS ist einfach "hans.css")
-        chap_soup = BeautifulSoup('<html><head><link rel="stylesheet" href="hans.css" type="text/css"/></head><body></body></html>', 'html.parser')
-        
-        valuable = False
-        for item in section:
-            node = BeautifulSoup(str(item), 'html.parser').contents[0]
-            if isinstance(node, Tag):
-                # Bilder-Pfade auf flache Ebene korrigieren
-                # 1. Alle Bilder (img-Tags) korrigieren
-                for img in node.find_all('img'):
-                    old_src = img.get('src', '')
-                    f_name = os.path.basename(old_src) # Nur der Dateiname, z.B. TAG05.jpg
-                    
-                    # Pfad zur lokalen Datei auf deinem PC prüfen
-                    local_img = os.path.join(FOLDER_BILDER, f_name)
-                    if os.path.exists(local_img):
-                        img_uid = f"img_{f_name.replace('.', '_')}"
-                        # Bild nur hinzufügen, wenn es noch nicht im Buch ist
-                        if img_uid not in [it.id for it in book.items]:
-                            ext = f_name.split('.')[-1].lower()
-                            mtype = "image/png" if ext == 'png' else "image/jpeg"
-                            with open(local_img, 'rb') as imf:
-                                img_item = epub.EpubItem(uid=img_uid, file_name=f_name, media_type=mtype, content=imf.read())
-                                book.add_item(img_item)
-                                print(f"Bild hinzugefügt: {f_name}")
-                        
-                        # WICHTIG: Die Quelle im HTML auf den lokalen Namen setzen
-                        img['src'] = f_name 
-            
-                # Alle "Zurück zum Index" Links im Kapitel finden
-                for a_link in node.find_all('a', href=True):
-                    if a_link['href'] == "#index":
-                        # Link zum generierten Inhaltsverzeichnis des EPUBs umleiten
-                        a_link['href'] = "nav.xhtml"
-
-                        # Falls ein Button-Tag darin ist, entfernen wir es und behalten nur den Text
-                        btn = a_link.find('button')
-                        if btn:
-                            # Wir geben dem Link eine Klasse für das CSS-Styling
-                            # a_link['class'] = a_link.get('class', []) + ['btn-back']
-                            a_link['class'] = a_link.get('class', []) + ['button']
-                            a_link.string = btn.get_text() # Setzt "Zurück zum Index" als Text
-
-                # 2. Falls Bilder in Links (a-Tags) eingebettet sind (Lightbox-Stil)
-                for a_link in node.find_all('a'):
-                    link_href = a_link.get('href', '')
-                    # Prüfen, ob der Link auf ein Bild verweist
-                    if link_href.lower().endswith(('.jpg', '.jpeg', '.png')):
-                        a_name = os.path.basename(link_href)
-                        # Link im Buch auf die lokale Datei umbiegen
-                        a_link['href'] = a_name
-
-                if node.get_text(strip=True) or node.find('img'):
-                    valuable = True
-            chap_soup.body.append(node)
-            chap_soup.body.append(node)
-
-        if valuable:
-            # Dateiname ohne Unterordner
-            chap = epub.EpubHtml(title=title, file_name=f'chap_{i}.xhtml', lang='de')
-            chap.content = chap_soup.encode(formatter="html").decode('utf-8')
-            # WICHTIG: Hier wird das Stylesheet dem Kapitel zugewiesen
-            chap.add_item(style_item)
-            book.add_item(chap)
-            chapters.append(chap)
+    # 3. KAPITEL-SPLITTING (Sektionen werden erst beim Iterieren erzeugt)
+    profiler.step('chapters')
+    sections = iter_source_sections(SOURCE_FILES, parser, streaming, profiler, session)
+
+    # Zu große Kapitel werden an Überschriften in mehrere Dateien geteilt (0 = aus)
+    max_bytes = int(config_dict.get("chapter_max_kb", 0)) * 1024
+    max_nodes = int(config_dict.get("chapter_max_nodes", 0))
+    # Unterpunkte (h2/h3) je Kapitel im Inhaltsverzeichnis
+    chapter_toc = bool(config_dict.get("chapter_toc", False))
+
+    chapters = []                                                           # Spine: alle Dateien, auch Teile
+    toc_chapters = []                                                       # TOC: ein Eintrag je Kapitel
+    toc_entries = []                                                        # dito, mit Unterpunkten bei chapter_toc
+    documents = [(preface_item, preface_anchors)] if preface_item else []   # Link-Index: Datei und ihre Anker
+    missing_images = []                                                     # Asset-Bericht am Ende
+    split_count = 0
+    i = -1
+    for html_dir, section in sections:
+        # Cache-Treffer: Kapitel unverändert, nur die Bilder neu anmelden
+        chapter_key = cache.key('chapter', section.key, parser, max_bytes, max_nodes, chapter_toc) if cache else None
+        result = cache.get_json(chapter_key) if cache else None
+        if result is not None and not restore_resources(result, html_dir, FOLDER_BILDER, registry, snapshots):
+            result = None
+        cached = result is not None
+        if result is None:
+            nodes = section.nodes                                           # Streaming: hier wird geparst
+            with profiler.phase('render'):
+                result = render_chapter(nodes, html_dir, FOLDER_BILDER, registry, css_pruner, snapshots,
+                                        max_bytes, max_nodes, chapter_toc)
+            if cache: cache.put_json(chapter_key, result)
+        elif css_pruner and css_pruner.pending and result['valuable']:
+            css_pruner.scan(parse_html(result['content'], parser))           # Cache-Treffer: DOM nur für den Selektor-Test
+        if result['empty']: continue                                        # Streaming: Fragment nur aus Kommentaren/<hr>
+        i += 1
+        missing_images.extend(result['missing'])
+
+        if result['valuable']:
+            used_chars.update(result['chars'])
+            title = result['title'] or f"Kapitel {i+1}"
+            parts = result['parts'] or [[title, result['content'], result['anchors'], result['headings']]]
+            if result['parts']: split_count += 1
+            sub_toc = []
+            for k, (part_title, content, anchors, headings) in enumerate(parts):
+                # Dateiname ohne Unterordner, Teile als chap_{i}_{k}.xhtml
+                file_name = f'chap_{i}_{k}.xhtml' if result['parts'] else f'chap_{i}.xhtml'
+                if result['parts']:
+                    content = PART_HREF_RE.sub(lambda m: f'chap_{i}_{m.group(1)}.xhtml', content)
+                chap = epub.EpubHtml(title=title if k == 0 else part_title or title, file_name=file_name, lang='de')
+                chap.content = content
+                # WICHTIG: Hier wird das Stylesheet dem Kapitel zugewiesen
+                chap.add_item(style_item)
+                book.add_item(chap)
+                chapters.append(chap)
+                documents.append((chap, anchors))
+                for _, anchor, text in headings:
+                    if chapter_toc and text != title:
+                        sub_toc.append(epub.Link(f'{file_name}#{anchor}', text, f'chap_{i}_h{len(sub_toc)}'))
+                if k == 0:
+                    toc_chapters.append(chap)
+                    profiler.chapter(chap.file_name, result, cached)
+            toc_entries.append((toc_chapters[-1], sub_toc) if sub_toc else toc_chapters[-1])
 
     # 4. FINISH
     # book.toc = tuple(chapters)
@@ -385,21 +2572,72 @@ def create_epub():
     # 4. ABSCHLUSS
     if not chapters:
         print("FEHLER: Keine Kapitel gefunden.")
-        return
+        finish_profile(profiler, cprofile, config_dict, base_dir, None)
+        return None
+
+    # Links auf Anker in anderen Kapiteln (z.B. href="#tag05") auf die richtige Datei umleiten
+    profiler.step('links')
+    dangling = rewrite_fragment_links(documents)
+    if dangling:
+        print(f"HINWEIS: {len(dangling)} Links ohne Ziel im Buch:")
+        for file_name, anchor in dangling[:10]:
+            print(f" -> {file_name}: #{anchor}")
+        if len(dangling) > 10:
+            print(f" -> ... und {len(dangling) - 10} weitere")
 
     # Inhaltsverzeichnis (TOC) zusammenstellen
     # Wir verwenden nur das bereits existierende preface_item Objekt
     if preface_item:
-        full_toc = [preface_item] + chapters
+        full_toc = [preface_item] + toc_entries
     else:
-        full_toc = chapters
+        full_toc = toc_entries
 
+    profiler.step('toc')
     book.toc = tuple(full_toc)
     
     # Navigationselemente hinzufügen
     book.add_item(epub.EpubNcx())
     book.add_item(epub.EpubNav())
 
+    # Ungenutzte Regeln, Desktop-@media und Fonts ohne Verwendung entfernen
+    if css_pruner:
+        profiler.step('css_prune')
+        old_size = len(css_content.encode('utf-8'))
+        css_content, unused_selectors, removed_fonts = css_pruner.prune(registry)
+        style_item.content = css_content
+        saved_fonts = sum(size for _, size in removed_fonts)
+        saved_css = old_size - len(css_content.encode('utf-8'))
+        print(f"CSS-Pruning: {unused_selectors} ungenutzte Selektoren, CSS {old_size / 1024:.1f} KB -> "
+              f"{(old_size - saved_css) / 1024:.1f} KB, {len(removed_fonts)} Fonts entfernt "
+              f"({saved_fonts / 1024:.1f} KB). Gespart: {(saved_css + saved_fonts) / 1024:.1f} KB")
+        for name, _ in removed_fonts:
+            print(f" -> Font ohne Verwendung: {name}")
+
+    registry.report()
+    used_paths = set(registry.by_path)
+    print_asset_report(list(dict.fromkeys(missing_images)),
+                       manifest.unused(FOLDER_BILDER, used_paths) + manifest.unused(FOLDER_FONTS, used_paths))
+
+    # Fonts auf die genutzten Zeichen reduzieren (parallel je Font, nur wenn konfiguriert)
+    font_report = []
+    if config_dict.get("font_subset", False):
+        profiler.step('font_subset')
+        used_chars.update(css_content_chars(css_content))
+        used_chars.update(css_case_chars(css_content, used_chars))
+        css_content, font_report = subset_fonts(registry, used_chars, css_content,
+                                                bool(config_dict.get("font_woff2", False)),
+                                                int(config_dict.get("image_workers", 0)), cache)
+        style_item.content = css_content
+
+    # Bilder optimieren (parallel, nur wenn in der JSON konfiguriert)
+    profiler.step('images')
+    image_report = optimize_images(registry,
+                                   int(config_dict.get("image_max_edge", 0)),
+                                   int(config_dict.get("image_quality", 0)),
+                                   bool(config_dict.get("image_strip_exif", False)),
+                                   int(config_dict.get("image_workers", 0)),
+                                   cache)
+
     # Die 'spine' bestimmt die Lesereihenfolge
     # WICHTIG: preface_item ist das Objekt, das wir oben mit book.add_item hinzugefügt haben
     if preface_item:
@@ -408,8 +2646,411 @@ def create_epub():
         book.spine = ['nav'] + chapters
 
     # Buch schreiben
-    epub.write_epub(OUTPUT_EPUB, book)
-    print(f"FERTIG: {OUTPUT_EPUB} erstellt mit {len(chapters)} Kapiteln.")
+    profiler.step('write')
+    changed = write_book(OUTPUT_EPUB, book, config_dict.get("writer", "ebooklib"), session.entries if session else None,
+                         build_time if reproducible else None)
+    split_info = f" ({split_count} davon wegen Größe geteilt, {len(chapters)} Dateien)" if split_count else ""
+    print(f"FERTIG: {OUTPUT_EPUB} erstellt mit {len(toc_chapters)} Kapiteln{split_info}.")
+    print_image_report(image_report)
+    print_font_report(font_report)
+    if cache: cache.report()
+    finish_profile(profiler, cprofile, config_dict, base_dir, OUTPUT_EPUB)
+    return {'output': OUTPUT_EPUB, 'chapters': len(toc_chapters), 'changed': changed}
+
+
+# ------------------------------------------------------------------------------------------
+# Batch-Modus: viele Bücher in einem Prozess-Pool
+# ------------------------------------------------------------------------------------------
+def _warm_up():
+    """Initializer der Pool-Prozesse: Parser einmal je Prozess importieren statt je Buch."""
+    resolve_parser('auto')
+
+
+def build_book(json_file_name, overrides=None):
+    """Baut ein Buch im Batch. Fehler werden gemeldet, nie weitergeworfen.
+
+    Eine fehlende oder kaputte JSON ist ein Fehler des Buchs: anders als beim Einzel-Build wird
+    sie nicht durch die Defaults ersetzt (die Steuerdatei des Benutzers bliebe sonst verloren).
+    Rückgabe: {'json', 'output', 'seconds', 'size', 'chapters', 'changed', 'error', 'log'}
+    """
+    start = time.perf_counter()
+    log = io.StringIO()
+    result = {'json': json_file_name, 'output': None, 'size': 0, 'chapters': 0, 'error': None}
+    try:
+        with open(json_file_name, 'r', encoding='utf-8') as f:
+            if not isinstance(json.load(f), dict):
+                raise ValueError("kein JSON-Objekt")
+    except (OSError, ValueError) as e:
+        result['error'] = f"JSON nicht lesbar ({e})"
+        result['seconds'] = time.perf_counter() - start
+        result['log'] = ""
+        return result
+    try:
+        with contextlib.redirect_stdout(log):                               # Ausgaben der Bücher nicht vermischen
+            built = create_epub(json_file_name, overrides=overrides)
+        if built is None:
+            result['error'] = "Keine Kapitel gefunden"
+        else:
+            result.update(built)
+            result['size'] = os.path.getsize(built['output'])
+    except SystemExit:                                                      # check_resources bricht bei fehlender HTML ab
+        result['error'] = "Abbruch: Quell-HTML fehlt"
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+        log.write(traceback.format_exc())
+    result['seconds'] = time.perf_counter() - start
+    result['log'] = log.getvalue()
+    return result
+
+
+def collect_json_files(source):
+    """JSON-Dateien aus einem Ordner (*.json) oder einem Manifest (eine Datei pro Zeile bzw. JSON-Liste).
+
+    Im Ordner zählen die Profile der Bücher (profile_json) nicht als Buch, sonst würde die
+    Selbstheilung sie beim nächsten Lauf zu einer Steuerdatei umschreiben.
+    """
+    if os.path.isdir(source):
+        candidates = sorted(glob.glob(os.path.join(source, '*.json')))
+        outputs = {os.path.normcase(os.path.abspath(os.path.join(source, DEFAULT_CONFIG["config"]["profile_json"])))}
+        for path in candidates:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    config = json.load(f).get("config")
+            except (OSError, ValueError, AttributeError):
+                continue                                                    # kaputte JSON baut load_json neu auf
+            if isinstance(config, dict) and config.get("profile_json"):
+                outputs.add(os.path.normcase(os.path.abspath(os.path.join(source, config["profile_json"]))))
+        return [path for path in candidates if os.path.normcase(os.path.abspath(path)) not in outputs]
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, 'r', encoding='utf-8') as f:
+        text = f.read()
+    if source.lower().endswith('.json'):
+        entries = json.loads(text)
+    else:
+        entries = [line.strip() for line in text.splitlines() if line.strip() and not line.startswith('#')]
+    return [os.path.join(base, entry) for entry in entries]
+
+
+def batch_build(json_files, workers=0, overrides=None):
+    """Baut alle Bücher parallel. Ein fehlerhaftes Buch hält die anderen nicht auf."""
+    workers = min(workers or os.cpu_count() or 1, len(json_files)) or 1
+    # Je Buch nur ein Prozess für Bilder/Fonts, parallelisiert wird über die Bücher
+    overrides = {'image_workers': 1, **(overrides or {})}
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_warm_up) as pool:
+        futures = [pool.submit(build_book, json_file, overrides) for json_file in json_files]
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:                                          # z.B. abgestürzter Worker-Prozess
+                results.append({'json': json_files[len(results)], 'output': None, 'seconds': 0.0, 'size': 0,
+                                'chapters': 0, 'error': f"{type(e).__name__}: {e}", 'log': ""})
+    print_batch_summary(results, time.perf_counter() - start)
+    return results
+
+
+def print_batch_summary(results, total_seconds):
+    """Tabelle mit Laufzeit, Größe und Fehlern je Buch."""
+    print("\n" + "=" * 100)
+    print(f"{'Buch (JSON)':45s} {'Zeit s':>8s} {'MB':>8s} {'Kapitel':>8s}  Status")
+    print("-" * 100)
+    for r in results:
+        status = "OK" if r['error'] is None else f"FEHLER: {r['error']}"
+        if r['error'] is None and r.get('changed') is False:
+            status = "OK (unverändert)"
+        name = os.path.join(os.path.basename(os.path.dirname(r['json'])), os.path.basename(r['json']))
+        print(f"{name[-45:]:45s} {r['seconds']:8.1f} {r['size'] / 1024 / 1024:8.1f} "
+              f"{r['chapters']:8d}  {status}")
+    failed = [r for r in results if r['error'] is not None]
+    print("-" * 100)
+    print(f"{len(results) - len(failed)} von {len(results)} Büchern erstellt in {total_seconds:.1f} s.")
+    for r in failed:
+        if not r['log']:
+            continue                                                        # z.B. JSON nicht lesbar: steht schon in der Tabelle
+        print(f"\n--- Log {r['json']} (Ende) ---")
+        print("\n".join(r['log'].splitlines()[-15:]))
+
+
+# ------------------------------------------------------------------------------------------
+# Watch-Modus: das Buch bei jeder gespeicherten Änderung neu bauen, Zustand bleibt im Speicher
+# ------------------------------------------------------------------------------------------
+WATCH_INTERVAL = 0.5                                                        # Sekunden zwischen zwei Prüfungen
+WATCH_RESCAN_INTERVAL = 10.0                                                # Sekunden: dann auch unveränderte Ordner neu listen
+BREAK_TAG = re.compile(r'<break[\s/>]', re.I)
+
+
+def _common_prefix(a, b):
+    """Länge des gemeinsamen Anfangs zweier Texte (binäre Suche, Vergleich in C)."""
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix(a, b, limit):
+    """Länge des gemeinsamen Endes zweier Texte, höchstens limit Zeichen."""
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:] == b[len(b) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+class IncrementalSplitter:
+    """Zerlegt die Quell-HTML wie SectionSplitter und merkt sich Text und Fragment-Grenzen.
+
+    Beim nächsten Aufruf wird nur der Bereich zwischen gemeinsamem Anfang und Ende von altem
+    und neuem Text neu zerlegt, alle Fragmente davor und danach werden übernommen. Endet der
+    geänderte Bereich nicht auf oberster Ebene (z.B. ein noch offenes Tag), wird wie bisher
+    das ganze Dokument zerlegt.
+    """
+    def __init__(self):
+        self.text = None
+        self.fragments = []                                                 # (Anfang, Ende, Quelltext) als Offsets
+        self.reused = 0
+
+    @staticmethod
+    def _split(text, base=0, in_body=False, final=True):
+        """SectionSplitter über text; None, wenn der Bereich mitten in einem Element endet."""
+        splitter = SectionSplitter()
+        splitter.in_body = in_body
+        splitter.feed(text)
+        if final:
+            splitter.close()
+        elif splitter.stack or splitter.rawdata:                           # offenes Element oder halbes Tag
+            return None
+        else:
+            splitter._flush(splitter.getpos())
+        line_starts = [0] + [m.end() for m in re.finditer('\n', text)]
+
+        def offset(pos):
+            return None if pos is None else base + line_starts[pos[0] - 1] + pos[1]
+        return [(offset(start), offset(end), fragment)
+                for (start, end), fragment in zip(splitter.spans, splitter.fragments)]
+
+    def _update(self, old, text):
+        """Neue Fragmentliste aus den unveränderten alten Fragmenten oder None."""
+        prefix = _common_prefix(old, text)
+        if prefix == len(old) == len(text):
+            return self.fragments
+        suffix = _common_suffix(old, text, min(len(old), len(text)) - prefix)
+        delta = len(text) - len(old)
+        head = [f for f in self.fragments if f[1] is not None and f[1] <= prefix]
+        tail = [f for f in self.fragments if f[0] is not None and f[0] >= len(old) - suffix]
+        if not head:
+            return None
+        start = head[-1][1]
+        if not BREAK_TAG.match(text, start):                               # Kapitelanfang selbst geändert
+            return None
+        if tail:
+            middle = self._split(text[start:tail[0][0] + delta], base=start, in_body=True, final=False)
+        else:
+            middle = self._split(text[start:], base=start, in_body=True)
+        if middle is None:
+            return None
+        self.reused = len(head) + len(tail)
+        return head + middle + [(a + delta, None if b is None else b + delta, fragment) for a, b, fragment in tail]
+
+    def split(self, text):
+        """Liefert die Fragmente von text (Quelltext je <break> Sektion)."""
+        old, self.text = self.text, text
+        fragments = self._update(old, text) if old is not None else None
+        if fragments is None:
+            fragments = self._split(text)
+            self.reused = 0
+        elif fragments is self.fragments:
+            self.reused = len(fragments)
+        self.fragments = fragments
+        return [fragment for _, _, fragment in fragments]
+
+
+class SessionCache(BuildCache):
+    """BuildCache, der Kapitel und CSS (JSON-Ergebnisse) zusätzlich im Speicher hält."""
+    def __init__(self, folder, max_bytes):
+        super().__init__(folder, max_bytes)
+        self.values = {}
+
+    def get_json(self, key):
+        if key in self.values:
+            self.hits += 1
+            return self.values[key]
+        value = super().get_json(key)
+        if value is not None:
+            self.values[key] = value
+        return value
+
+    def put_json(self, key, value):
+        self.values[key] = value
+        super().put_json(key, value)
+
+
+class WatchSession:
+    """Was zwischen zwei Builds im Speicher bleibt: Cache, Datei-Hashes, Sektionen, fertige Kapitel."""
+    def __init__(self, cache):
+        self.cache = cache
+        self.digests = {}                                                   # (Pfad, Größe, mtime) -> (SHA-1, Größe)
+        self.splitters = {}                                                 # Quell-HTML -> IncrementalSplitter
+        self.entries = {}                                                   # StreamingEpubWriter.entry_memo
+
+    def sections(self, source_html, parser, profiler=None):
+        """Sektionen der Quell-HTML; unveränderte Fragmente werden nicht neu zerlegt."""
+        profiler = profiler or NO_PROFILER
+        with profiler.phase('split'):
+            with open(source_html, 'r', encoding='utf-8') as f:
+                text = f.read()
+            splitter = self.splitters.setdefault(os.path.abspath(source_html), IncrementalSplitter())
+            fragments = splitter.split(text)
+        if splitter.reused < len(fragments):
+            print(f"{os.path.basename(source_html)}: {len(fragments)} Sektionen, "
+                  f"davon {splitter.reused} unverändert übernommen.")
+        return [Section(fragment=fragment, parser=parser, profiler=profiler) for fragment in fragments]
+
+
+class FolderStamps:
+    """mtime und Größe aller Dateien in Bilder- und Font-Ordner (mit Unterordnern) für den Watch-Modus.
+
+    Je Prüfung kostet jeder Ordner nur ein stat(). Neu gelistet (os.scandir, DirEntry.stat() ist
+    unter Windows ohne Extra-Zugriff) werden nur Ordner, deren mtime sich geändert hat: Datei
+    angelegt, gelöscht oder umbenannt. Eine an Ort und Stelle überschriebene Datei ändert die
+    Ordner-mtime nicht, deshalb wird alle rescan_interval Sekunden trotzdem alles gelistet.
+    """
+    def __init__(self, rescan_interval=WATCH_RESCAN_INTERVAL):
+        self.rescan_interval = rescan_interval
+        self.folders = {}                                                   # Ordner -> (mtime_ns, {Pfad: Stempel}, [Unterordner])
+        self.last_full = None                                               # time.monotonic() des letzten vollen Listings
+
+    def stamps(self, roots):
+        """{Pfad: (mtime_ns, Größe)} aller Dateien unter roots."""
+        now = time.monotonic()
+        full = self.last_full is None or now - self.last_full >= self.rescan_interval
+        if full:
+            self.last_full = now
+        result = {}
+        seen = set()
+        pending = list(roots)
+        while pending:
+            folder = pending.pop()
+            if folder in seen:
+                continue
+            seen.add(folder)
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+            except OSError:                                                 # Ordner fehlt (noch)
+                continue
+            cached = self.folders.get(folder)
+            if full or cached is None or cached[0] != mtime:
+                cached = (mtime, *self._scan(folder))
+                self.folders[folder] = cached
+            result.update(cached[1])
+            pending.extend(cached[2])
+        for folder in set(self.folders) - seen:
+            del self.folders[folder]
+        return result
+
+    @staticmethod
+    def _scan(folder):
+        files = {}
+        subfolders = []
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subfolders.append(entry.path)
+                        elif entry.is_file():
+                            st = entry.stat()
+                            files[entry.path] = (st.st_mtime_ns, st.st_size)
+                    except OSError:                                         # zwischen Listing und stat() gelöscht
+                        continue
+        except OSError:
+            pass
+        return files, subfolders
+
+
+def watch_stamps(json_file, config_dict, base_dir, folder_stamps=None):
+    """mtime und Größe aller Dateien, die das Buch beeinflussen (JSON, HTML, CSS, Vorwort, Bilder, Fonts).
+
+    Bilder und Fonts kommen aus folder_stamps (FolderStamps), das zwischen den Prüfungen bestehen bleibt.
+    """
+    paths = [json_file, os.path.join(base_dir, config_dict.get("source_css", ""))]
+    paths += resolve_sources(config_dict.get("source_html", ""), base_dir)      # neue Dateien zu einem Muster zählen mit
+    preface = config_dict.get("preface", "none")
+    if preface.lower() != "none":
+        paths.append(os.path.join(base_dir, preface))
+    stamps = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        stamps[path] = (st.st_mtime_ns, st.st_size)
+    folder_stamps = folder_stamps or FolderStamps()
+    stamps.update(folder_stamps.stamps([os.path.join(base_dir, config_dict.get(key, ""))
+                                        for key in ('folder_bilder', 'folder_fonts')]))
+    return stamps
+
+
+def watch(json_file_name=None, overrides=None, interval=WATCH_INTERVAL):
+    """Baut das Buch und danach bei jeder Änderung erneut, bis Strg+C gedrückt wird.
+
+    Unveränderte Sektionen werden weder neu zerlegt noch geparst, Bilder nicht neu gehasht
+    und unveränderte Kapitel nicht neu serialisiert. Das EPUB selbst wird komplett neu
+    geschrieben (ein ZIP lässt sich nicht sicher stellenweise ändern); Bilder und Fonts
+    werden dabei nur kopiert. Geschrieben wird immer mit dem Streaming-Writer.
+    """
+    # Ohne Angabe dieselbe JSON und derselbe Basisordner wie load_json/create_epub (auch als Exe)
+    json_file = os.path.abspath(json_file_name or IchSelbst().path_name_without_suffix + ".json")
+    base_dir = os.path.dirname(json_file) if json_file_name else BASE_DIR
+    overrides = {'writer': 'stream', **(overrides or {})}
+    config_dict = None
+    json_stamp = None
+    session = None
+    stamps = None
+    folder_stamps = FolderStamps()
+    print(f"Watch-Modus: {json_file} (Strg+C beendet)")
+    try:
+        while True:
+            try:
+                current_json = os.stat(json_file).st_mtime_ns
+            except OSError:
+                current_json = None
+            if config_dict is None or current_json != json_stamp:           # JSON nur nach Änderung neu lesen (fehlt sie, legt load_json sie an)
+                config_dict = {**load_json(json_file).get("config"), **overrides}
+                json_stamp = current_json
+            current = watch_stamps(json_file, config_dict, base_dir, folder_stamps)
+            if current != stamps:
+                if stamps is not None:
+                    changed = sorted(path for path in set(current) | set(stamps) if current.get(path) != stamps.get(path))
+                    print(f"\nGeändert: {', '.join(os.path.basename(path) for path in changed[:5])}"
+                          f"{' ...' if len(changed) > 5 else ''}")
+                if session is None:
+                    folder = str(config_dict.get("cache_folder", ".epub_cache"))
+                    if folder.lower() == "none":
+                        print("HINWEIS: Der Watch-Modus braucht einen Cache, verwende .epub_cache.")
+                        folder = ".epub_cache"
+                    session = WatchSession(SessionCache(os.path.join(base_dir, folder),
+                                                        int(config_dict.get("cache_max_mb", 500)) * 1024 * 1024))
+                stamps = current                                            # Änderungen während des Builds lösen den nächsten aus
+                session.cache.hits = session.cache.misses = 0
+                start = time.perf_counter()
+                try:
+                    create_epub(json_file, base_dir, overrides, session=session)
+                except SystemExit:                                          # check_resources bricht bei fehlender HTML ab
+                    print("FEHLER: Quell-HTML fehlt, warte auf Änderungen.")
+                except Exception:
+                    traceback.print_exc()
+                print(f"Build in {time.perf_counter() - start:.2f} s. Warte auf Änderungen ...")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("\nWatch-Modus beendet.")
 
 
 # -------------------------------------------------------------
@@ -466,9 +3107,36 @@ class IchSelbst:
             self.data_file = self.path_name_without_suffix
 
 
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Erstellt EPUB Bücher aus HTML.")
+    parser.add_argument("json_file", nargs="?", default=None,
+                        help="JSON-Steuerdatei (Standard: JSON neben dem Skript)")
+    parser.add_argument("--batch", metavar="ORDNER_ODER_MANIFEST",
+                        help="Alle *.json eines Ordners oder die Einträge eines Manifests bauen")
+    parser.add_argument("--workers", type=int, default=0, help="Parallele Bücher im Batch (0 = alle CPU-Kerne)")
+    parser.add_argument("--watch", action="store_true",
+                        help="Nach dem Build auf Änderungen warten und das Buch jeweils neu bauen")
+    parser.add_argument("--check", action="store_true",
+                        help="Nur prüfen: fehlende und ungenutzte Bilder/Fonts melden, kein Build")
+    parser.add_argument("--profile", action="store_true",
+                        help="Zeiten, I/O und Kapitel-Zähler je Phase messen (wie \"profile\": true in der JSON)")
+    return parser.parse_args(argv)
+
+
 if __name__ == '__main__':
+    multiprocessing.freeze_support()                                        # Prozess-Pool auch in der kompilierten EXE
+    args = parse_arguments()
     os.system('cls')
     print("Version v1.0 dated 01/2026")
     print("Written by Hans Strassguetl - mail@hs58.de")
     print("Licenced under [https://creativecommons.org/licenses/by-sa/4.0/](https://creativecommons.org/licenses/by-sa/4.0/)")
-    create_epub()
\ No newline at end of file
+    overrides = {'profile': True} if args.profile else None
+    if args.batch:
+        results = batch_build(collect_json_files(args.batch), args.workers, overrides)
+        sys.exit(1 if any(r['error'] for r in results) else 0)
+    if args.check:
+        sys.exit(1 if preflight_assets(args.json_file, overrides) else 0)
+    if args.watch:
+        watch(args.json_file, overrides)
+        sys.exit(0)
+    create_epub(args.json_file, overrides=overrides)
\ No newline at end of file